@@ -0,0 +1,59 @@
+"""Measure the CPU of many servers playing the same stream, shared or not.
+
+Every server's player reads its source on its own thread, like in
+``playback_bench``. Unshared streams get a url of their own, so each one
+runs its own ffmpeg process. Needs ffmpeg and libopus.
+
+Run from the repository root with ``python -m benchmarks.broadcast_bench [file]``.
+"""
+import os
+import sys
+import tempfile
+import threading
+from benchmarks.playback_bench import cpu_time, make_sample, play, serve
+from utils.audio import audio_source
+from utils.metrics import metrics
+
+SERVERS = (1, 8, 32)
+# (playback mode, volume)
+PATHS = (('opus', 1.), ('pcm', .5))
+
+
+def measure(url: str, mode: str, volume: float, servers: int, shared: bool) -> tuple[float, float]:
+    """CPU seconds for each minute of audio, and the share of frames every server got."""
+    os.environ['PLAYBACK_MODE'] = mode
+    frames: list[int] = []
+    sources = [
+        audio_source(url if shared else f'{url}&server={i}', volume)
+        for i in range(servers)
+    ]
+    before = cpu_time()
+    threads = [threading.Thread(target=play, args=(source, frames)) for source in sources]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    used = cpu_time() - before
+    # discord frames are 20ms long
+    minutes = max(frames) * .02 / 60
+    return used / minutes, sum(frames) / (max(frames) * servers)
+
+
+def main():
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.abspath(sys.argv[1]) if len(sys.argv) > 1 else make_sample(folder)
+        server = serve(os.path.dirname(path))
+        url = f'http://127.0.0.1:{server.server_port}/{os.path.basename(path)}?mime=audio%2Fwebm'
+        print(f'{"path":>10}{"servers":>9}{"separate cpu s/min":>20}{"shared cpu s/min":>18}{"frames":>8}')
+        for mode, volume in PATHS:
+            for servers in SERVERS:
+                separate, _ = measure(url, mode, volume, servers, False)
+                shared, complete = measure(url, mode, volume, servers, True)
+                name = f'{mode}@{volume:g}'
+                print(f'{name:>10}{servers:>9}{separate:>20.3f}{shared:>18.3f}{complete:>8.0%}')
+        server.shutdown()
+        print(metrics.report())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+"""Measure how late a voice thread's 20ms ticks get while lookups run.
+
+yt-dlp's extraction is pure python, so running it on the resolver threads
+holds the GIL away from the voice threads. Lookups are simulated with a pure
+python loop of about the same length, run on threads like the in process
+resolver, and in another process like the resolver service.
+
+Run from the repository root with ``python -m benchmarks.jitter_bench``.
+"""
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from utils.search import RESOLVER_WORKERS
+
+LOOKUPS = 64
+# iterations of the simulated lookup, around 100ms of cpu
+LOOKUP_WORK = 2_000_000
+TICK = .02
+
+
+def lookup(work: int = LOOKUP_WORK) -> int:
+    total = 0
+    for i in range(work):
+        total += i
+    return total
+
+
+def voice(stop: threading.Event, lateness: list[float]):
+    """Tick every 20ms like discord's audio player and note how late each tick is."""
+    due = time.perf_counter() + TICK
+    while not stop.is_set():
+        time.sleep(max(0., due - time.perf_counter()))
+        now = time.perf_counter()
+        lateness.append(max(0., now - due))
+        # each tick is measured on its own, late ones don't push the rest
+        due = max(due, now) + TICK
+
+
+def measure(pool: ThreadPoolExecutor | ProcessPoolExecutor | None) -> list[float]:
+    """Tick lateness while the pool runs the lookups, or for a few idle seconds without one."""
+    stop = threading.Event()
+    lateness: list[float] = []
+    thread = threading.Thread(target=voice, args=(stop, lateness))
+    thread.start()
+    if pool:
+        with pool:
+            list(pool.map(lookup, [LOOKUP_WORK] * LOOKUPS))
+    else:
+        time.sleep(3)
+    stop.set()
+    thread.join()
+    return sorted(lateness)
+
+
+def main():
+    print(f'{"lookups in":>12}{"p50 ms":>9}{"p99 ms":>9}{"max ms":>9}')
+    for name, pool in (
+        ('nothing', None),
+        ('threads', ThreadPoolExecutor(RESOLVER_WORKERS)),
+        ('process', ProcessPoolExecutor(RESOLVER_WORKERS)),
+    ):
+        lateness = measure(pool)
+        p50 = lateness[len(lateness) // 2] * 1000
+        p99 = lateness[min(len(lateness) - 1, int(len(lateness) * .99))] * 1000
+        print(f'{name:>12}{p50:>9.1f}{p99:>9.1f}{lateness[-1] * 1000:>9.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,44 @@
+"""Measure the memory each queued song costs.
+
+Run from the repository root with ``python -m benchmarks.memory_bench``.
+"""
+import gc
+import tracemalloc
+from utils.music import Song, Time
+from utils.songqueue import SongQueue
+
+SIZES = (10_000, 100_000)
+# songs of a spotify album share its cover
+ALBUM_SIZE = 12
+
+
+def make_song(i: int) -> Song:
+    return Song(
+        type='spotify',
+        title=f'Artist {i % 997} - Track {i}',
+        thumbnail=f'https://i.scdn.co/image/{i // ALBUM_SIZE:040x}',
+        length=float(120 + i % 300),
+        spurl=f'https://open.spotify.com/track/{i:022d}'
+    )
+
+
+def measure(amount: int) -> float:
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    queue = SongQueue(make_song(i) for i in range(amount))
+    wait = queue.wait_time(len(queue))
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    assert wait > 0
+    return used / amount
+
+
+def main():
+    print(f'{"queued songs":>14}{"bytes/song":>12}')
+    for amount in SIZES:
+        print(f'{amount:>14}{measure(amount):>12.0f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+"""Compare MixerSource with discord's PCMVolumeTransformer per 20ms frame.
+
+Runs on generated pcm, no voice connection or ffmpeg needed.
+
+Run from the repository root with ``python -m benchmarks.mixer_bench``.
+"""
+import io
+import time
+import discord
+import numpy as np
+from utils.mixer import CHANNELS, FRAME_SAMPLES, MixerSource
+
+FRAMES = 5_000
+
+
+def make_pcm(frames: int) -> bytes:
+    rng = np.random.default_rng(0)
+    samples = rng.integers(-12000, 12000, frames * FRAME_SAMPLES * CHANNELS, dtype=np.int16)
+    return samples.tobytes()
+
+
+def pcm_source(pcm: bytes) -> discord.PCMAudio:
+    return discord.PCMAudio(io.BytesIO(pcm))
+
+
+def measure(source: discord.AudioSource) -> float:
+    """Microseconds per frame."""
+    frames = 0
+    started = time.perf_counter()
+    while source.read():
+        frames += 1
+    return (time.perf_counter() - started) / frames * 1e6
+
+
+def main():
+    pcm = make_pcm(FRAMES)
+    plain = measure(pcm_source(pcm))
+    cases = {
+        'PCMVolumeTransformer 1.0': lambda: discord.PCMVolumeTransformer(pcm_source(pcm), 1.),
+        'PCMVolumeTransformer 0.5': lambda: discord.PCMVolumeTransformer(pcm_source(pcm), .5),
+        'MixerSource 1.0': lambda: MixerSource(pcm_source(pcm), 1.),
+        'MixerSource 0.5': lambda: MixerSource(pcm_source(pcm), .5),
+    }
+
+    def crossfade():
+        source = MixerSource(pcm_source(pcm), .5)
+        source.crossfade_from(pcm_source(pcm), FRAMES * .02)
+        return source
+
+    def ducked():
+        source = MixerSource(pcm_source(pcm), .5)
+        source.overlay(pcm_source(pcm))
+        return source
+
+    cases['MixerSource crossfade'] = crossfade
+    cases['MixerSource overlay + duck'] = ducked
+    print(f'{"source":>28}{"us/frame":>10}')
+    print(f'{"raw read":>28}{plain:>10.1f}')
+    for name, make in cases.items():
+        print(f'{name:>28}{measure(make()):>10.1f}')
+
+
+if __name__ == '__main__':
+    main()
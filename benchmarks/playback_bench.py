@@ -0,0 +1,108 @@
+"""Measure the CPU each playing stream costs with the pcm and opus paths.
+
+Every stream is read on its own thread like discord's audio player does, pcm
+frames are encoded to opus there. The track is served over local http since
+the ffmpeg options are meant for streams. Needs ffmpeg and libopus.
+
+Run from the repository root with ``python -m benchmarks.playback_bench [file]``,
+without a file a minute long opus track is generated. Files have to be opus
+in webm for the opus path to copy them.
+"""
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import discord
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from utils.audio import audio_source
+
+STREAMS = (1, 4, 8)
+# (playback mode, volume)
+PATHS = (('pcm', 1.), ('opus', 1.))
+SAMPLE_SECONDS = 60
+
+
+def make_sample(folder: str) -> str:
+    path = os.path.join(folder, 'sample.webm')
+    subprocess.run(
+        [
+            'ffmpeg', '-loglevel', 'error', '-f', 'lavfi',
+            '-i', f'sine=frequency=440:duration={SAMPLE_SECONDS}',
+            '-ac', '2', '-c:a', 'libopus', path
+        ],
+        check=True
+    )
+    return path
+
+
+def play(source: discord.AudioSource, frames: list[int]):
+    encoder = None if source.is_opus() else discord.opus.Encoder()
+    count = 0
+    while data := source.read():
+        if encoder:
+            encoder.encode(data, encoder.SAMPLES_PER_FRAME)
+        count += 1
+    source.cleanup()
+    frames.append(count)
+
+
+def cpu_time() -> float:
+    times = os.times()
+    return times.user + times.system + times.children_user + times.children_system
+
+
+def measure(url: str, mode: str, volume: float, streams: int) -> float:
+    """CPU seconds per stream for each minute of audio."""
+    os.environ['PLAYBACK_MODE'] = mode
+    frames: list[int] = []
+    before = cpu_time()
+    threads = [
+        threading.Thread(target=play, args=(audio_source(url, volume), frames))
+        for _ in range(streams)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    used = cpu_time() - before
+    # discord frames are 20ms long
+    minutes = sum(frames) * .02 / 60
+    return used / minutes
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+class QuietServer(ThreadingHTTPServer):
+    # ffmpeg hangs up mid response whenever a source is cleaned up early
+    def handle_error(self, request, client_address):
+        pass
+
+
+def serve(folder: str) -> ThreadingHTTPServer:
+    handler = partial(QuietHandler, directory=folder)
+    server = QuietServer(('127.0.0.1', 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.abspath(sys.argv[1]) if len(sys.argv) > 1 else make_sample(folder)
+        server = serve(os.path.dirname(path))
+        # tagged like youtube's stream urls so the codec is known
+        url = f'http://127.0.0.1:{server.server_port}/{os.path.basename(path)}?mime=audio%2Fwebm'
+        print(f'{"path":>12}{"streams":>9}{"cpu s/stream/audio min":>24}')
+        for mode, volume in PATHS:
+            for streams in STREAMS:
+                name = f'{mode}@{volume:g}'
+                print(f'{name:>12}{streams:>9}{measure(url, mode, volume, streams):>24.3f}')
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+"""Compare SongQueue with the plain list queue it replaced.
+
+Run from the repository root with ``python -m benchmarks.queue_bench``.
+"""
+import random
+import time
+from utils.music import Song, Time
+from utils.songqueue import SongQueue
+
+SIZES = (1_000, 10_000, 100_000)
+REPEAT = 200
+
+
+def make_songs(amount: int) -> list[Song]:
+    return [
+        Song(
+            type='youtube',
+            title=f'song {i}',
+            thumbnail=None,
+            length=random.randint(60, 600),
+            yturl=f'https://www.youtube.com/watch?v={i:011d}'
+        )
+        for i in range(amount)
+    ]
+
+
+def list_wait_time(queue: list[Song], pos: int) -> float:
+    waited = Time(0)
+    for song in queue[:pos]:
+        waited += song.duration
+    return waited.value
+
+
+def list_move(queue: list[Song], _from: int, _to: int):
+    queue.insert(_to, queue.pop(_from))
+
+
+def list_swap(queue: list[Song], pos1: int, pos2: int):
+    queue[pos1], queue[pos2] = queue[pos2], queue[pos1]
+
+
+def queue_move(queue: SongQueue, _from: int, _to: int):
+    queue.move(_from, _to)
+
+
+def queue_swap(queue: SongQueue, pos1: int, pos2: int):
+    queue.swap(pos1, pos2)
+
+
+def measure(func, queue, amount: int) -> float:
+    """Microseconds per call, positions drawn at random."""
+    args = [(random.randrange(amount), random.randrange(amount)) for _ in range(REPEAT)]
+    start = time.perf_counter()
+    for pos1, pos2 in args:
+        func(queue, pos1, pos2)
+    return (time.perf_counter() - start) / REPEAT * 1e6
+
+
+def pop_and_append(queue, *_):
+    queue.append(queue.pop(0))
+
+
+def wait_time(func):
+    return lambda queue, pos, _: func(queue, pos)
+
+
+def remove_range(queue, pos, _):
+    removed = queue[pos:pos+10]
+    del queue[pos:pos+10]
+    queue[pos:pos] = removed
+
+
+def main():
+    operations = {
+        'head pop + append': (pop_and_append, pop_and_append),
+        'wait time': (wait_time(list_wait_time), wait_time(SongQueue.wait_time)),
+        'move': (list_move, queue_move),
+        'swap': (list_swap, queue_swap),
+        'range remove': (remove_range, remove_range),
+    }
+    print(f'{"operation":<20}{"size":>10}{"list us":>12}{"treap us":>12}')
+    for amount in SIZES:
+        songs = make_songs(amount)
+        for name, (list_op, queue_op) in operations.items():
+            list_us = measure(list_op, list(songs), amount - 10)
+            queue_us = measure(queue_op, SongQueue(songs), amount - 10)
+            print(f'{name:<20}{amount:>10}{list_us:>12.1f}{queue_us:>12.1f}')
+
+
+if __name__ == '__main__':
+    main()
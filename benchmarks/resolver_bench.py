@@ -0,0 +1,66 @@
+"""Measure how long a small server waits for lookups next to a heavy one.
+
+The heavy server queues hundreds of lookups at once, like pasting a few big
+playlists of links, and keeps its prefetching busy. The small server makes a
+play request every so often. Lookups are simulated with a sleep, and the
+resolver pool is compared with and without the fair scheduler.
+
+Run from the repository root with ``python -m benchmarks.resolver_bench``.
+"""
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from utils.scheduler import LANE_BACKGROUND, LANE_INTERACTIVE, ResolverScheduler
+from utils.search import RESOLVER_WORKERS
+
+# seconds a simulated yt-dlp lookup takes
+LOOKUP_SECONDS = .05
+HEAVY_INTERACTIVE = 300
+HEAVY_BACKGROUND = 300
+LIGHT_REQUESTS = 20
+LIGHT_INTERVAL = .25
+
+
+def lookup():
+    time.sleep(LOOKUP_SECONDS)
+
+
+async def scenario(run) -> list[float]:
+    """Seconds each of the small server's lookups took."""
+    heavy = [asyncio.create_task(run(1, LANE_INTERACTIVE)) for _ in range(HEAVY_INTERACTIVE)]
+    heavy += [asyncio.create_task(run(1, LANE_BACKGROUND)) for _ in range(HEAVY_BACKGROUND)]
+    latencies = []
+    for _ in range(LIGHT_REQUESTS):
+        started = time.perf_counter()
+        await run(2, LANE_INTERACTIVE)
+        latencies.append(time.perf_counter() - started)
+        await asyncio.sleep(LIGHT_INTERVAL)
+    await asyncio.gather(*heavy)
+    return latencies
+
+
+async def main():
+    pool = ThreadPoolExecutor(max_workers=RESOLVER_WORKERS)
+    loop = asyncio.get_running_loop()
+
+    async def fifo(guild: int, lane: int):
+        await loop.run_in_executor(pool, lookup)
+
+    scheduler = ResolverScheduler(pool, RESOLVER_WORKERS)
+
+    async def fair(guild: int, lane: int):
+        await scheduler.run(lookup, guild, lane)
+
+    print(f'{"resolver":>10}{"p50 ms":>10}{"p95 ms":>10}{"max ms":>10}{"total s":>10}')
+    for name, run in (('fifo', fifo), ('fair', fair)):
+        started = time.perf_counter()
+        latencies = sorted(await scenario(run))
+        total = time.perf_counter() - started
+        p50 = latencies[len(latencies) // 2] * 1000
+        p95 = latencies[min(len(latencies) - 1, int(len(latencies) * .95))] * 1000
+        print(f'{name:>10}{p50:>10.0f}{p95:>10.0f}{latencies[-1] * 1000:>10.0f}{total:>10.1f}')
+    pool.shutdown()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
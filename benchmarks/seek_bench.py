@@ -0,0 +1,78 @@
+"""Measure how long a seek takes until its first frame is ready.
+
+Compares the old output side ``-ss`` with input side seeking, over http like
+youtube streams, and from a local file like the audio cache. The local http
+server doesn't do range requests, unlike youtube, so ffmpeg still reads up to
+the offset there, it just doesn't decode it. Needs ffmpeg.
+
+Run from the repository root with ``python -m benchmarks.seek_bench [file]``,
+without a file an hour long opus track is generated, which takes a while.
+"""
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import discord
+from utils.audio import FFMPEG_OPTIONS, audio_source
+from benchmarks.playback_bench import serve
+
+OFFSETS = (10, 300, 3600)
+SAMPLE_SECONDS = 3700
+REPEAT = 3
+
+
+def make_sample(folder: str) -> str:
+    path = os.path.join(folder, 'long.webm')
+    subprocess.run(
+        [
+            'ffmpeg', '-loglevel', 'error', '-f', 'lavfi',
+            '-i', f'sine=frequency=440:duration={SAMPLE_SECONDS}',
+            '-ac', '2', '-c:a', 'libopus', '-b:a', '64k', path
+        ],
+        check=True
+    )
+    return path
+
+
+def output_seek(url: str, start: float) -> discord.AudioSource:
+    """How seek used to build its source."""
+    return discord.FFmpegPCMAudio(
+        url,
+        before_options=FFMPEG_OPTIONS['before_options'],
+        options=f'-vn -ss {start}'
+    )
+
+
+def first_frame(make) -> float:
+    """Milliseconds until the source's first frame, best of a few runs."""
+    times = []
+    for _ in range(REPEAT):
+        started = time.perf_counter()
+        source = make()
+        assert source.read()
+        times.append(time.perf_counter() - started)
+        source.cleanup()
+    return min(times) * 1000
+
+
+def main():
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.abspath(sys.argv[1]) if len(sys.argv) > 1 else make_sample(folder)
+        server = serve(os.path.dirname(path))
+        url = f'http://127.0.0.1:{server.server_port}/{os.path.basename(path)}?mime=audio%2Fwebm'
+        cases = {
+            'http output -ss': lambda start: output_seek(url, start),
+            'http input -ss pcm': lambda start: audio_source(url, .5, start),
+            'http input -ss opus': lambda start: audio_source(url, 1., start),
+            'local input -ss': lambda start: audio_source(path, 1., start),
+        }
+        print(f'{"seek":>22}' + ''.join(f'{f"{offset}s ms":>12}' for offset in OFFSETS))
+        for name, make in cases.items():
+            row = [first_frame(lambda: make(offset)) for offset in OFFSETS]
+            print(f'{name:>22}' + ''.join(f'{ms:>12.1f}' for ms in row))
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -7,15 +7,18 @@ class database(commands.Cog):
         self.ready: bool = False
         self.server_music: dict[int, ServerMusic] = {}
         for guild in self.client.server_info:
-            self.server_music[guild] = ServerMusic()
+            self.server_music[guild] = ServerMusic(guild_id=guild, queue=make_queue(guild))
 
     @commands.Cog.listener()
     async def on_guild_join(self, guild: discord.Guild):
-        self.server_music[guild.id] = ServerMusic()
+        self.server_music[guild.id] = ServerMusic(guild_id=guild.id, queue=make_queue(guild.id))
 
     @commands.Cog.listener()
     async def on_guild_remove(self, guild: discord.Guild):
-        self.server_music.pop(guild.id)
+        server_music = self.server_music.pop(guild.id)
+        server_music.unshuffle()
+        if isinstance(server_music.queue, DiskQueue):
+            server_music.queue.close()
 
 
 async def setup(client: commands.Bot):
@@ -1,14 +1,26 @@
 from utils import *
 from discord.ui import View, Select
 import asyncio
-from time import sleep
+import time
+import traceback
+from contextlib import aclosing
 from cogs.database import database
 
+# seconds between live updates of a loading playlist's embed
+PLAYLIST_EDIT_INTERVAL = 2
+
 
 class music(commands.Cog):
     def __init__(self, client: commands.Bot):
         self.client = client
         self.database: database = self.client.get_cog('database')
+        self.idle = IdleScheduler()
+
+    async def cog_unload(self):
+        self.idle.cancel_all()
+        await Spotify.client.close()
+        if remote := remote_resolver():
+            await remote.close()
 
     @commands.Cog.listener()
     async def on_voice_state_update(self, member: discord.Member, before: discord.VoiceState, after: discord.VoiceState):
@@ -21,13 +33,19 @@ class music(commands.Cog):
                 await server_music.vc.disconnect()
                 server_music.vc.cleanup()
                 server_music.vc = None
+            if server_music.player:
+                server_music.player.cancel()
+                server_music.player = None
             server_music.clear()
             server_music.is_playing = False
             server_music.current_song = None
+            self.idle.cancel(member.guild.id)
 
     async def update_now_playing(self, ctx: commands.Context):
         server_music = self.database.server_music[ctx.guild.id]
         prev_now_playing: discord.Message = server_music.now_playing
+        server_music.now_playing = None
+        # the message may be gone or the channel unwritable, neither should stop the player
         if server_music.current_song:
             song = server_music.current_song
             embed = discord.Embed(
@@ -35,9 +53,15 @@ class music(commands.Cog):
                 description=f'[**{song.title}**]({song.link})',
                 color=SILVER
             )
-            server_music.now_playing = await ctx.channel.send(embed=embed)
+            try:
+                server_music.now_playing = await ctx.channel.send(embed=embed)
+            except discord.HTTPException as e:
+                print(e)
         if prev_now_playing:
-            await prev_now_playing.delete()
+            try:
+                await prev_now_playing.delete()
+            except discord.HTTPException as e:
+                print(e)
 
     def playlist_embed(self, playlist: Playlist):
         embed = discord.Embed(title='Playlist Added', color=SILVER)
@@ -45,21 +69,26 @@ class music(commands.Cog):
             name='Playlist',
             value=f'[{playlist.title}]({playlist.url})', inline=False
         )
-        embed.add_field(name='Playlist Length', value=f'{playlist.duration}')
-        embed.add_field(name='Tracks', value=f'{playlist.track_num}')
+        if playlist.is_loading:
+            embed.add_field(name='Playlist Length', value=f'{playlist.duration}+')
+            embed.add_field(name='Tracks', value=f'{playlist.loaded}/{playlist.track_num}')
+        else:
+            embed.add_field(name='Playlist Length', value=f'{playlist.duration}')
+            embed.add_field(name='Tracks', value=f'{playlist.track_num}')
         embed.set_thumbnail(
-            url=playlist.thumbnail if 'https://' in playlist.thumbnail and '.' in playlist.thumbnail else None
+            url=playlist.thumbnail if playlist.thumbnail and 'https://' in playlist.thumbnail and '.' in playlist.thumbnail else None
         )
         return embed
 
-    def added_embed(self, song: Song, server_music):
-        if server_music.vc.is_paused():
-            server_music.current_song.reset_time()
-        wait_time = server_music.current_song.duration - \
-            server_music.current_song.progress
-        for song in server_music.queue:
-            wait_time += song.duration
-        wait_time -= song.duration
+    def added_embed(self, song: Song, server_music, pos: int | None = None):
+        if pos is None:
+            pos = len(server_music) - 1
+        wait_time = Time(server_music.queue.wait_time(pos))
+        # none between songs, eg. while the player skips one that failed to load
+        if current := server_music.current_song:
+            if server_music.vc.is_paused():
+                current.reset_time()
+            wait_time += current.duration - current.progress
         embed = discord.Embed(title='Added Track', color=SILVER)
         embed.add_field(
             name='Track',
@@ -68,7 +97,7 @@ class music(commands.Cog):
         )
         embed.add_field(name='Estimated wait time', value=wait_time)
         embed.add_field(name='Track Length', value=song.duration)
-        embed.add_field(name='Position in queue', value=len(server_music))
+        embed.add_field(name='Position in queue', value=pos+1)
         embed.set_thumbnail(url=song.thumbnail)
         return embed
 
@@ -124,85 +153,300 @@ class music(commands.Cog):
                 await send_notice(ctx, 'Failed to connect to a voice channel.')
                 return False
 
-    def play_loop(self, ctx: commands.Context):
+    def start_player(self, ctx: commands.Context):
+        server_music = self.database.server_music[ctx.guild.id]
+        if server_music.player and not server_music.player.done():
+            server_music.post(ENQUEUE)
+            return
+        server_music.events = asyncio.Queue()
+        server_music.player = asyncio.create_task(self.player(ctx))
+
+    def schedule_prewarm(self, ctx: commands.Context):
+        """Prewarm the next song shortly before the playing one's stream runs out."""
         server_music = self.database.server_music[ctx.guild.id]
         server_info: ServerInfo = self.client.server_info[ctx.guild.id]
-        if server_info.loop != 'disabled' and server_music.current_song:
-            if server_music.current_song.url and not server_music.current_song.source:
-                if server_info.loop == 'queue':
-                    server_music.queue.append(server_music.current_song)
-                elif server_info.loop == 'song':
-                    server_music.queue.insert(0, server_music.current_song)
-        if len(server_music.queue) > 0:
-            server_music.is_playing = True
-            server_music.current_song = server_music.queue[0]
-            server_music.queue.pop(0)
+        song = server_music.current_song
+        length = song.expected_length if song else None
+        # resuming schedules it again
+        if not length or server_info.loop == 'song' or server_music.vc.is_paused():
+            return
+        stream = buffered(server_music.vc.source)
+        position = stream.position if stream else song.progress.value
+        server_music.prewarmer.schedule(length - position, server_info.volume/100)
+
+    def requeue(self, ctx: commands.Context):
+        server_music = self.database.server_music[ctx.guild.id]
+        server_info: ServerInfo = self.client.server_info[ctx.guild.id]
+        song = server_music.current_song
+        if server_info.loop == 'disabled' or not song:
+            return
+        if song.url and not song.source:
+            if server_info.loop == 'queue':
+                server_music.queue.append(song)
+            elif server_info.loop == 'song':
+                server_music.queue.insert(0, song)
+
+    async def load_source(self, song: Song, volume: float, guild_id: int) -> discord.AudioSource | None:
+        for attempt in range(LOAD_ATTEMPTS):
             try:
-                source = server_music.current_song.extract_source()
-                source = discord.PCMVolumeTransformer(
-                    source,
-                    server_info.volume/100
+                # waits for a free process slot as long as it takes, running out
+                # of them is no reason to skip the song
+                return await prepare_source(song, volume, frames=0, guild_id=guild_id, timeout=None)
+            except Exception as e:
+                print(e)
+                song.invalidate()
+                await asyncio.sleep(attempt + 1)
+        return None
+
+    async def wait_track(self, server_music: ServerMusic) -> str:
+        """Wait for the current song to end, returns what ended it."""
+        reason = TRACK_ENDED
+        while True:
+            event = await server_music.events.get()
+            if event == TRACK_ENDED:
+                return reason
+            if event in (SKIP, SEEK, STOP):
+                reason = event
+                if event == SKIP and isinstance(server_music.vc.source, MixerSource):
+                    # keeps playing under the next song
+                    server_music.outgoing = server_music.vc.source.detach()
+                server_music.vc.stop()
+
+    async def wait_enqueue(self, server_music: ServerMusic):
+        while await server_music.events.get() != ENQUEUE:
+            pass
+
+    def start_feed(self, ctx: commands.Context) -> asyncio.Task:
+        server_music = self.database.server_music[ctx.guild.id]
+        if not server_music.feeding or server_music.feeding.done():
+            server_music.feeding = asyncio.create_task(self.feed(ctx))
+        return server_music.feeding
+
+    async def feed(self, ctx: commands.Context):
+        """Extract the next window of the lazy playlists that are running low."""
+        server_music = self.database.server_music[ctx.guild.id]
+        for cursor in list(server_music.feeders):
+            anchor = cursor.last
+            if server_music.index(anchor) >= PLAYLIST_LOW_WATER:
+                continue
+            try:
+                songs = await run_in_resolver(cursor.next_window, guild_id=ctx.guild.id, lane=LANE_BACKGROUND)
+            except Exception as e:
+                print(e)
+                songs = []
+                cursor.done = True
+            if cursor not in server_music.feeders:  # cleared meanwhile
+                continue
+            if cursor.done:
+                server_music.feeders.remove(cursor)
+            # the anchor may have moved while extracting
+            server_music.insert(server_music.index(anchor) + 1, songs)
+            if cursor.message:
+                try:
+                    await cursor.message.edit(embed=self.playlist_embed(cursor.playlist))
+                except discord.HTTPException:
+                    cursor.message = None
+
+    async def player(self, ctx: commands.Context):
+        """Play through the queue, a crash leaves the server ready for a new player."""
+        server_music = self.database.server_music[ctx.guild.id]
+        try:
+            await self.play_queue(ctx)
+        except Exception:
+            print(f'The player of {ctx.guild.id} crashed:')
+            traceback.print_exc()
+        finally:
+            server_music.supervisor.cancel()
+            server_music.prewarmer.cancel_timer()
+            # a newer player may have been started meanwhile
+            if server_music.player in (None, asyncio.current_task()):
+                if server_music.vc and server_music.vc.is_playing():
+                    server_music.vc.stop()
+                server_music.is_playing = False
+                server_music.current_song = None
+
+    async def play_queue(self, ctx: commands.Context):
+        server_music = self.database.server_music[ctx.guild.id]
+        server_info: ServerInfo = self.client.server_info[ctx.guild.id]
+        loop = asyncio.get_running_loop()
+        failures = 0
+        ended_at = None
+        previous: BufferedSource | None = None
+        reason = None
+        while server_music.vc and server_music.vc.is_connected():
+            if server_music.feeders:
+                feeding = self.start_feed(ctx)
+                if not server_music.queue:
+                    await feeding
+            if not server_music.queue:
+                server_music.drop_outgoing()
+                server_music.is_playing = False
+                server_music.current_song = None
+                await self.update_now_playing(ctx)
+                self.idle.schedule(
+                    ctx.guild.id,
+                    lambda: self.idle_disconnect(ctx.guild.id)
                 )
+                await self.wait_enqueue(server_music)
+                ended_at = None
+                previous = None
+                reason = None
+                continue
+            self.idle.cancel(ctx.guild.id)
+            server_music.is_playing = True
+            server_music.current_song = server_music.queue.pop(0)
+            volume = server_info.volume/100
+            source = await server_music.prewarmer.take(server_music.current_song, volume)
+            metrics.incr('player.prewarmed' if source else 'player.cold_starts')
+            server_music.retarget()
+            source = source or await self.load_source(server_music.current_song, volume, ctx.guild.id)
+            if not source:
+                metrics.incr('player.failed_tracks')
+                server_music.current_song = None
+                reason = None
+                failures += 1
+                if failures >= MAX_FAILURES:
+                    server_music.clear()
+                    try:
+                        await send_notice(ctx, 'Could not play the songs in the queue.')
+                    except discord.HTTPException as e:
+                        print(e)
+                continue
+            failures = 0
+            if server_music.outgoing and isinstance(source, MixerSource):
+                source.crossfade_from(server_music.outgoing)
+                server_music.outgoing = None
+            server_music.drop_outgoing()
+            try:
                 server_music.vc.play(
                     source,
-                    after=lambda _: self.play_loop(ctx)
-                )
-                server_music.current_song.reset_time()
-                asyncio.run_coroutine_threadsafe(
-                    self.update_now_playing(ctx),
-                    self.client.loop
+                    after=lambda _: loop.call_soon_threadsafe(
+                        server_music.post,
+                        TRACK_ENDED
+                    )
                 )
-            except Exception as e:
+            except discord.ClientException as e:
+                # voice dropped while the source was loading
                 print(e)
-                self.play_loop(ctx)
-        else:
-            server_music.is_playing = False
-            server_music.current_song = None
-            asyncio.run_coroutine_threadsafe(
-                self.update_now_playing(ctx),
-                self.client.loop
-            )
-            elapsed = 0
-            while True:
-                sleep(1)
-                elapsed += 1
-                if server_music.is_playing and not server_music.vc.is_paused():
-                    break
-                if elapsed == 600:
-                    if not server_music.is_playing and server_music.vc:
-                        asyncio.run_coroutine_threadsafe(
-                            server_music.vc.disconnect(),
-                            self.client.loop
-                        )
-                if not server_music.vc or not server_music.vc.is_connected():
-                    break
+                source.cleanup()
+                server_music.current_song.release()
+                server_music.current_song = None
+                continue
+            if ended_at:
+                metrics.observe('player.transition', loop.time() - ended_at)
+            stream = buffered(source)
+            song = server_music.current_song
+            song.reset_time()
+            # a seek or resume plays the same song on
+            if reason != SEEK:
+                audio_cache.played(video_id(song.yturl), song.url)
+            if stream:
+                server_music.supervisor.watch(stream)
+            self.schedule_prewarm(ctx)
+            await self.update_now_playing(ctx)
+            reason = await self.wait_track(server_music)
+            server_music.supervisor.cancel()
+            ended_at = loop.time()
+            if reason == TRACK_ENDED and stream and server_music.vc.is_connected():
+                resumed = await server_music.supervisor.recover(song, stream, volume)
+                if resumed:
+                    song.source = resumed
+                    server_music.queue.insert(0, song)
+                    reason = SEEK
+            if song.requested_at and stream and stream.started_at:
+                # from the play command to the first frame sent to discord
+                metrics.observe('play.time_to_audio', stream.started_at - song.requested_at)
+                song.requested_at = None
+            if previous and stream and previous.ended_at and stream.started_at:
+                gap = max(0., stream.started_at - previous.ended_at)
+                server_music.transitions.append(gap)
+                metrics.observe('player.gap', gap)
+            previous = stream
+            if reason != SEEK:
+                server_music.current_song.release()
+            if reason not in (SEEK, STOP):
+                self.requeue(ctx)
+
+    def restart(self, server_music: ServerMusic, source: discord.AudioSource):
+        """Replace the current song's source, eg. after a seek."""
+        server_music.current_song.source = source
+        server_music.queue.insert(0, server_music.current_song)
+        server_music.post(SEEK)
+
+    async def idle_disconnect(self, guild_id: int):
+        server_music = self.database.server_music[guild_id]
+        if server_music.is_playing or not server_music.vc:
+            return
+        await server_music.vc.disconnect()
 
     @commands.group(aliases=['p'], invoke_without_command=True, help='<song name/url>', description='Plays a song.\n`[Music]`')
     async def play(self, ctx: commands.Context, *, query: str):
+        requested_at = time.monotonic()
         server_music = self.database.server_music[ctx.guild.id]
         connected = await self.connect(ctx)
         if not connected:
             return
-        songs, playlist = search(query)
-        if playlist:
-            embed = self.playlist_embed(playlist)
-            await ctx.send(embed=embed)
-        if not songs:
-            await send_notice(ctx, 'Could not play song.')
+        message: discord.Message | None = None
+        edited_at = 0.
+        queued = 0
+        generation = server_music.generation
+        try:
+            async with aclosing(resolve_pages(query, ctx.guild.id)) as pages:
+                async for songs, playlist in pages:
+                    # stopped, cleared or disconnected while the playlist was loading
+                    if server_music.generation != generation:
+                        return
+                    if playlist and not message:
+                        message = await ctx.send(embed=self.playlist_embed(playlist))
+                        edited_at = self.client.loop.time()
+                        # a stale feeder would extract into the next session's queue
+                        if server_music.generation != generation:
+                            return
+                        if playlist.pending:
+                            playlist.pending.message = message
+                            server_music.feeders.append(playlist.pending)
+                    elif playlist:
+                        now = self.client.loop.time()
+                        if not playlist.is_loading or now - edited_at >= PLAYLIST_EDIT_INTERVAL:
+                            await message.edit(embed=self.playlist_embed(playlist))
+                            edited_at = now
+                    if not songs:
+                        continue
+                    # or while the embed was being sent
+                    if server_music.generation != generation:
+                        return
+                    server_music.enqueue(songs)
+                    if not server_music.is_playing:
+                        if not queued:
+                            songs[0].requested_at = requested_at
+                        self.start_player(ctx)
+                    else:
+                        if not playlist:
+                            embed = self.added_embed(
+                                songs[0],
+                                server_music,
+                                len(server_music) - len(songs)
+                            )
+                            await ctx.send(embed=embed)
+                    if not queued:
+                        # the stream urls are resolved later, see play.time_to_audio
+                        metrics.observe('play.ack', time.monotonic() - requested_at)
+                    queued += len(songs)
+        except Exception as e:
+            # eg. some links of a batch couldn't be found, the rest are queued
+            if not queued:
+                raise
+            print(e)
+            await send_notice(ctx, 'Some of the songs could not be added.', notice_type=WARNING)
             return
-        server_music.queue += songs
-        if not server_music.is_playing:
-            self.play_loop(ctx)
-        else:
-            if not playlist:
-                embed = self.added_embed(songs[0], server_music)
-                await ctx.send(embed=embed)
+        if not queued:
+            await send_notice(ctx, 'Could not play song.')
 
     @play.command(name='search', aliases=['sc'], help='<song name>', description='Searches and lets you choose a song.\n`[Music]`')
     async def play_search(self, ctx: commands.Context, *, query: str):
         server_music = self.database.server_music[ctx.guild.id]
         youtube: Youtube = Youtube()
-        results: list[Song] = youtube.from_query_multiple(query)
+        results: list[Song] = await run_in_resolver(youtube.from_query_multiple, query, guild_id=ctx.guild.id)
         description = ''
         for i, song in enumerate(results):
             title = song.title.replace('[', '(').replace(']', ')')
@@ -222,17 +466,17 @@ class music(commands.Cog):
         async def select_callback(interaction: discord.Interaction):
             await interaction.response.defer()
             for value in interaction.data['values']:
-                song = youtube.from_url(value)
+                song = await run_in_resolver(youtube.from_url, value, guild_id=ctx.guild.id)
                 if not song:
                     continue
-                server_music.queue.append(song)
+                server_music.enqueue([song])
                 if server_music.is_playing:
                     added_embed = self.added_embed(song, server_music)
                     await ctx.send(embed=added_embed)
                     continue
                 connected = await self.connect(ctx)
                 if connected:
-                    self.play_loop(ctx)
+                    self.start_player(ctx)
                 else:
                     break
             embed = discord.Embed(title='Search results',
@@ -261,13 +505,13 @@ class music(commands.Cog):
             return
         attachment = message.attachments[0]
         try:
-            songs, playlist = search(attachment.url)
+            songs, playlist = await resolve(attachment.url, ctx.guild.id)
             if not songs:
                 await send_notice(ctx, 'Could not play song.')
                 return
-            server_music.queue += songs
+            server_music.enqueue(songs)
             if not server_music.is_playing:
-                self.play_loop(ctx)
+                self.start_player(ctx)
             else:
                 if not playlist:
                     embed = self.added_embed(
@@ -289,6 +533,8 @@ class music(commands.Cog):
             return
         server_music.current_song.save_progress()
         server_music.vc.pause()
+        # the next song waits with its ffmpeg unstarted until the pause is over
+        server_music.prewarmer.cancel_timer()
         await send_notice(ctx, 'Paused the song.', notice_type=MESSAGE)
 
     @commands.command(aliases=['continue', 'unpause'], help='', description='Resumes the current paused song.\n`[Music]`')
@@ -302,6 +548,7 @@ class music(commands.Cog):
             return
         server_music.current_song.reset_time()
         server_music.vc.resume()
+        self.schedule_prewarm(ctx)
         await send_notice(ctx, 'Resumed the song.', notice_type=MESSAGE)
 
     @commands.command(aliases=['s', 'next'], help='|<trackNumber>', description='Lets you skip the current song.\n`[Music]`|Skips to a specific track in the queue.\n`[Music]`')
@@ -311,7 +558,7 @@ class music(commands.Cog):
             await send_notice(ctx, 'The bot is currently not playing.', notice_type=ERROR)
             return
         if not skip_amount:
-            server_music.vc.stop()
+            server_music.post(SKIP)
             await ctx.message.add_reaction('✅')
             return
         skip_idx = skip_amount - 1
@@ -319,13 +566,13 @@ class music(commands.Cog):
         if queue_len == 0:
             await send_notice(ctx, 'There is currently no song in the queue.', notice_type=WARNING)
         elif skip_idx < queue_len:
-            server_music.queue = server_music.queue[skip_idx:]
+            server_music.remove(slice(0, skip_idx))
             await send_notice(ctx, f'Skipped `{skip_amount}` songs.', notice_type=MESSAGE)
-            server_music.vc.stop()
+            server_music.post(SKIP)
         else:
-            server_music.queue = server_music.queue[queue_len-1:]
+            server_music.remove(slice(0, queue_len-1))
             await send_notice(ctx, f'Skipped `{queue_len}` songs.', notice_type=MESSAGE)
-            server_music.vc.stop()
+            server_music.post(SKIP)
 
     @commands.command(help='', description='Stops all the songs.\n`[Music]`')
     async def stop(self, ctx: commands.Context):
@@ -334,7 +581,7 @@ class music(commands.Cog):
             await send_notice(ctx, 'The bot is currently not playing.', notice_type=ERROR)
             return
         server_music.clear()
-        server_music.vc.stop()
+        server_music.post(STOP)
         await ctx.message.add_reaction('✅')
 
     @commands.command(aliases=['c', 'empty', 'removeall'], help='', description='Clears the current queue.\n`[Music]`')
@@ -381,9 +628,9 @@ class music(commands.Cog):
         if not server_music.is_playing:
             await send_notice(ctx, 'The bot is currently not playing.', notice_type=ERROR)
             return
-        server_music.current_song.reset_time()
+        server_music.current_song.set_progress(0)
         server_music.queue.insert(0, server_music.current_song)
-        server_music.vc.stop()
+        server_music.post(SEEK)
         await ctx.message.add_reaction('✅')
 
     @commands.command(aliases=['sh'], help='', description='Shuffle the queue.\n`[Music]`')
@@ -398,6 +645,18 @@ class music(commands.Cog):
         server_music.shuffle()
         await ctx.message.add_reaction('✅')
 
+    @commands.command(aliases=['ush'], help='', description='Restore the queue order from before shuffling.\n`[Music]`')
+    async def unshuffle(self, ctx: commands.Context):
+        server_music = self.database.server_music[ctx.guild.id]
+        if not server_music.is_playing:
+            await send_notice(ctx, 'The bot is currently not playing.', notice_type=ERROR)
+            return
+        if not server_music.is_shuffled:
+            await send_notice(ctx, 'The queue is not shuffled.', notice_type=WARNING)
+            return
+        server_music.unshuffle()
+        await ctx.message.add_reaction('✅')
+
     @commands.command(help='', description='Reverse the current queue.\n`[Music]`')
     async def reverse(self, ctx: commands.Context):
         server_music = self.database.server_music[ctx.guild.id]
@@ -516,17 +775,36 @@ class music(commands.Cog):
         if not server_music.is_playing:
             await send_notice(ctx, 'The bot is currently not playing.', notice_type=ERROR)
             return
-        FFMPEG_OPTIONS = {
-            'before_options': '-reconnect 1 -reconnect_streamed 1 -reconnect_delay_max 5',
-            'options': f'-vn -ss {timestamp}'
-        }
-        url = server_music.current_song.url
-        source = discord.FFmpegPCMAudio(url, **FFMPEG_OPTIONS)
-        server_music.current_song.source = source
-        server_music.current_song.set_progress_str(timestamp)
-
-        server_music.queue.insert(0, server_music.current_song)
-        server_music.vc.stop()
+        server_info: ServerInfo = self.client.server_info[ctx.guild.id]
+        requested_at = self.client.loop.time()
+        song = server_music.current_song
+        target = parse_timestamp(timestamp)
+        stream = buffered(server_music.vc.source)
+        # the song's clock runs on while paused, the stream knows what it played
+        position = stream.position if stream else song.progress.value
+        back = position - target
+        if back > 0 and stream and stream.rewind(back):
+            source = server_music.vc.source
+            song.set_progress(target)
+            song.reset_time()
+            self.schedule_prewarm(ctx)
+            metrics.incr('player.rewinds')
+        else:
+            try:
+                # refreshes the stream url if it expired, or uses the local copy
+                source = await prepare_source(song, server_info.volume/100, target, 1, guild_id=ctx.guild.id)
+            except Exception as e:
+                print(e)
+                await send_notice(ctx, 'Could not seek in this song.', notice_type=ERROR)
+                return
+            if server_music.current_song is not song:
+                source.cleanup()
+                return
+            song.set_progress(target)
+            self.restart(server_music, source)
+        if isinstance(source, MixerSource):
+            source.fade_in()
+        metrics.observe('player.seek', self.client.loop.time() - requested_at)
         await ctx.message.add_reaction('✅')
 
     @commands.command(aliases=['vol', 'v'], help='|0-200', description='Show the current volume.\n`[Music]`|Change the bot\'s output volume.\n`[Music]`')
@@ -544,8 +822,36 @@ class music(commands.Cog):
             server_info.volume = vol
             await send_notice(ctx, f'Volume set to `{vol}%`.', notice_type=WARNING)
             save_info(self.client)
-            if server_music.is_playing:
-                server_music.vc.source.volume = vol/100
+            if server_music.is_playing and not set_volume(server_music.vc.source, vol/100):
+                song = server_music.current_song
+                position = song.progress.value
+                try:
+                    # refreshes the stream url if it expired, or uses the local copy
+                    source = await prepare_source(song, vol/100, position, 1, guild_id=ctx.guild.id)
+                except Exception as e:
+                    print(e)
+                    await send_notice(ctx, 'Could not change the volume of this song.', notice_type=ERROR)
+                    return
+                if server_music.current_song is not song:
+                    source.cleanup()
+                    return
+                song.set_progress(position)
+                self.restart(server_music, source)
+
+    @commands.command(aliases=['mstats'], help='', description='Shows the music player\'s metrics.\n`[Owner]`')
+    @commands.is_owner()
+    async def musicstats(self, ctx: commands.Context):
+        server_music = self.database.server_music[ctx.guild.id]
+        report = metrics.report() or 'No metrics yet.'
+        if server_music.transitions:
+            transitions = sorted(server_music.transitions)
+            report += f'\nserver gap p50: {transitions[len(transitions)//2]*1000:.0f}ms'
+        if broadcast_hub:
+            report += f'\nshared streams: {len(broadcast_hub)}'
+        report += f'\n{process_budget.report()}'
+        report += f'\n{resolver.report()}'
+        embed = discord.Embed(description=f'```{report}```', color=SILVER)
+        await ctx.send(embed=embed)
 
 
 async def setup(client: commands.Bot):
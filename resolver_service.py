@@ -0,0 +1,18 @@
+"""Runs the resolvers in a process of their own.
+
+Bots use it when RESOLVER_URL points at it, eg. http://127.0.0.1:8765, and
+several bot processes can share it along with its caches. Run it with
+``python resolver_service.py [port]``.
+"""
+import os
+import sys
+
+# this process resolves everything itself
+os.environ['RESOLVER_URL'] = ''
+
+from aiohttp import web
+from utils.remote import RESOLVER_PORT, resolver_app
+
+if __name__ == '__main__':
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else RESOLVER_PORT
+    web.run_app(resolver_app(), host='127.0.0.1', port=port)
@@ -1,5 +1,21 @@
 from .anilist import *
+from .audio import *
+from .audiocache import *
+from .broadcast import *
+from .cache import *
+from .diskqueue import *
 from .game import *
+from .matcher import *
+from .metrics import *
+from .mixer import *
 from .music import *
+from .player import *
+from .playorder import *
+from .probe import *
+from .processes import *
+from .remote import *
+from .scheduler import *
 from .search import *
 from .server import *
+from .songqueue import *
+from .spotify import *
@@ -0,0 +1,219 @@
+import os
+import threading
+import time
+import discord
+from collections import deque
+from urllib.parse import parse_qs, urlparse
+from .broadcast import broadcast_hub
+from .mixer import MixerSource
+from .processes import PRIORITY_LIVE, BudgetedSource, ProcessSlot, process_budget
+from .probe import probe_cache
+
+FFMPEG_OPTIONS = {
+    'before_options': '-reconnect 1 -reconnect_streamed 1 -reconnect_delay_max 5',
+    'options': '-vn'
+}
+# frames read ahead when a source is prewarmed, a second of audio
+PREBUFFER_FRAMES = 50
+# seconds of played audio kept for seeking back without a new stream
+RECENT_SECONDS = 15
+# containers youtube serves and the audio codec inside them
+MIME_CODECS = {
+    'audio/webm': 'opus',
+    'audio/mp4': 'aac',
+}
+
+
+def playback_mode() -> str:
+    """opus copies opus streams to discord as is, pcm always decodes them."""
+    return os.getenv('PLAYBACK_MODE', 'opus')
+
+
+def is_local(url: str) -> bool:
+    return '://' not in url
+
+
+def stream_codec(url: str) -> str | None:
+    """Audio codec of a stream url, from its mime type or an earlier probe."""
+    if is_local(url) and url.endswith('.opus'):
+        return 'opus'
+    mime = parse_qs(urlparse(url).query).get('mime')
+    if mime:
+        return MIME_CODECS.get(mime[0])
+    probe = probe_cache.get(url)
+    return probe.codec if probe else None
+
+
+class BufferedSource(discord.AudioSource):
+    """Stream that can read its first frames ahead of time and seek back a bit.
+
+    The last :data:`RECENT_SECONDS` of played frames are kept, so a short seek
+    back just plays them again. Also notes when its first frame came out and
+    when it ended, so the silence between two songs can be measured, and how
+    far into the song it got, so a stream that broke off can be resumed.
+
+    Attributes
+    -----------
+    original: :class:`discord.AudioSource`
+        The ffmpeg source.
+    start: :class:`float`
+        Seconds into the song the stream starts at.
+    played: :class:`int`
+        Frames played since the start.
+    frames: Deque[:class:`bytes`]
+        Frames read ahead of playback.
+    history: Deque[:class:`bytes`]
+        The most recently played frames.
+    started_at: :class:`float`
+        Monotonic time the first frame was read.
+    read_at: :class:`float`
+        Monotonic time the last frame was read.
+    ended_at: :class:`float`
+        Monotonic time the stream ran out or was cleaned up.
+    """
+
+    def __init__(self, original: discord.AudioSource, start: float = 0.):
+        self.original = original
+        self.start = start
+        self.played = 0
+        self.frames: deque[bytes] = deque()
+        self.history: deque[bytes] = deque(maxlen=int(RECENT_SECONDS / .02))
+        self.lock = threading.Lock()
+        self.started_at: float | None = None
+        self.read_at: float | None = None
+        self.ended_at: float | None = None
+
+    def fill(self, frames: int = PREBUFFER_FRAMES):
+        """Read ahead, which waits for ffmpeg to connect and start decoding."""
+        while len(self.frames) < frames:
+            data = self.original.read()
+            if not data:
+                break
+            with self.lock:
+                self.frames.append(data)
+
+    def rewind(self, seconds: float) -> bool:
+        """Play the last seconds again, False if they aren't kept anymore."""
+        count = round(seconds / .02)
+        with self.lock:
+            if count > len(self.history):
+                return False
+            for _ in range(count):
+                self.frames.appendleft(self.history.pop())
+            self.played -= count
+        return True
+
+    @property
+    def fell_behind(self) -> bool:
+        """Whether it ended by falling behind the other listeners of a shared stream."""
+        return getattr(self.original, 'fell_behind', False)
+
+    @property
+    def position(self) -> float:
+        """Seconds into the song of the next frame."""
+        return self.start + self.played * .02
+
+    def read(self) -> bytes:
+        with self.lock:
+            data = self.frames.popleft() if self.frames else None
+        if data is None:
+            data = self.original.read()
+        if data:
+            with self.lock:
+                self.history.append(data)
+                self.played += 1
+            self.read_at = time.monotonic()
+            if self.started_at is None:
+                self.started_at = self.read_at
+        elif self.ended_at is None:
+            self.ended_at = time.monotonic()
+        return data
+
+    def is_opus(self) -> bool:
+        return self.original.is_opus()
+
+    def cleanup(self):
+        if self.ended_at is None:
+            self.ended_at = time.monotonic()
+        self.original.cleanup()
+
+
+def buffered(source: discord.AudioSource | None) -> BufferedSource | None:
+    """The stream under a source made by :func:`audio_source`."""
+    if isinstance(source, MixerSource):
+        source = source.source
+    return source if isinstance(source, BufferedSource) else None
+
+
+def audio_source(
+    url: str,
+    volume: float = 1.,
+    start: float | None = None,
+    live: bool = False,
+    priority: int = PRIORITY_LIVE,
+    slot: ProcessSlot | None = None
+) -> discord.AudioSource:
+    """Create the source playing a stream url.
+
+    Parameters
+    -----------
+    url: :class:`str`
+        The audio url.
+    volume: :class:`float`
+        The volume multiplier.
+    start: :class:`float`
+        Where to start playing, in seconds.
+    live: :class:`bool`
+        Whether the url is a livestream.
+    priority: :class:`int`
+        The priority class of its ffmpeg process, see :class:`ProcessBudget`.
+    slot: :class:`ProcessSlot`
+        A slot taken ahead for its ffmpeg process, released if none is started.
+    """
+    options = FFMPEG_OPTIONS['options']
+    # local files can't reconnect
+    before_options = '' if is_local(url) else FFMPEG_OPTIONS['before_options']
+    if start:
+        # seeking the input makes ffmpeg jump there with a range request
+        # instead of decoding everything before it
+        before_options += f' -ss {start}'
+    copy = playback_mode() == 'opus' and volume == 1 and stream_codec(url) == 'opus'
+
+    def open_stream() -> discord.AudioSource:
+        nonlocal slot
+        taken, slot = slot or process_budget.acquire(priority), None
+        try:
+            if copy:
+                # ffmpeg only remuxes the packets, nothing gets decoded or encoded
+                source = discord.FFmpegOpusAudio(url, codec='copy', before_options=before_options, options=options)
+            else:
+                source = discord.FFmpegPCMAudio(url, before_options=before_options, options=options)
+        except Exception:
+            taken.release()
+            raise
+        return BudgetedSource(source, taken)
+
+    try:
+        if start:
+            original = open_stream()
+        else:
+            # servers starting the same stream together share its ffmpeg process
+            original = broadcast_hub.listen((url, copy), open_stream, live)
+    finally:
+        # joined a running broadcast, or failed before spawning
+        if slot:
+            slot.release()
+    stream = BufferedSource(original, start or 0.)
+    if copy:
+        return stream
+    # changing the volume needs decoded audio, which is cheaper to encode in
+    # the bot than with ffmpeg's libopus
+    return MixerSource(stream, volume)
+
+
+def set_volume(source: discord.AudioSource | None, volume: float) -> bool:
+    """Change a playing source's volume, False if it has to be restarted for it."""
+    if isinstance(source, MixerSource):
+        source.volume = volume
+        return True
+    return False
@@ -0,0 +1,216 @@
+import asyncio
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from .audio import FFMPEG_OPTIONS, is_local, stream_codec
+from .metrics import metrics
+from .processes import PRIORITY_PROBE, process_budget
+
+# where the cached tracks and their index are kept
+AUDIO_CACHE_DIR = 'audio_cache'
+# bytes of audio kept before the least recently played tracks are evicted
+AUDIO_CACHE_SIZE = 2 * 1024**3
+# plays from youtube before a track gets downloaded
+CACHE_AFTER_PLAYS = 3
+# downloads running at once
+DOWNLOAD_WORKERS = 2
+# seconds a download gets before it's killed
+DOWNLOAD_TIMEOUT = 600
+
+
+def file_digest(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        while chunk := file.read(1 << 20):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class AudioCache:
+    """Content addressed store of opus files for often played tracks.
+
+    Tracks are keyed by their youtube video id and stored under the sha256 of
+    their audio, so the same audio is kept once. The index lives in sqlite next
+    to the files, and once the files grow past the size limit the least
+    recently played ones are evicted.
+
+    Attributes
+    -----------
+    folder: :class:`str`
+        Where the files and the index are kept.
+    max_size: :class:`int`
+        The size limit in bytes.
+    threshold: :class:`int`
+        Plays before a track is downloaded.
+    downloading: Set[:class:`str`]
+        Keys of the running downloads.
+    """
+
+    def __init__(self, folder: str = AUDIO_CACHE_DIR, max_size: int = AUDIO_CACHE_SIZE, threshold: int = CACHE_AFTER_PLAYS):
+        self.folder = folder
+        self.max_size = max_size
+        self.threshold = threshold
+        self.conn: sqlite3.Connection | None = None
+        self.lock = threading.Lock()
+        self.downloading: set[str] = set()
+        self.workers: asyncio.Semaphore | None = None
+
+    def connect(self) -> sqlite3.Connection:
+        if self.conn is None:
+            os.makedirs(self.folder, exist_ok=True)
+            self.conn = sqlite3.connect(os.path.join(self.folder, 'index.db'), check_same_thread=False)
+            self.conn.execute(
+                'CREATE TABLE IF NOT EXISTS tracks ('
+                'key TEXT PRIMARY KEY, '
+                'plays INTEGER NOT NULL, '
+                'digest TEXT, '
+                'size INTEGER, '
+                'used_at REAL)'
+            )
+            self.conn.commit()
+        return self.conn
+
+    def path_of(self, digest: str) -> str:
+        return os.path.join(self.folder, digest[:2], f'{digest}.opus')
+
+    def get(self, key: str | None) -> str | None:
+        """Path of a track's local copy, if there is one."""
+        if not key:
+            return None
+        with self.lock:
+            conn = self.connect()
+            row = conn.execute('SELECT digest FROM tracks WHERE key = ?', (key,)).fetchone()
+            if not row or not row[0]:
+                return None
+            path = self.path_of(row[0])
+            if not os.path.exists(path):
+                conn.execute('UPDATE tracks SET digest = NULL, size = NULL WHERE key = ?', (key,))
+                conn.commit()
+                return None
+            conn.execute('UPDATE tracks SET used_at = ? WHERE key = ?', (time.time(), key))
+            conn.commit()
+        metrics.incr('audio_cache.hits')
+        return path
+
+    def played(self, key: str | None, url: str | None):
+        """Count a play streamed from url, downloading the track once it's played enough.
+
+        Has to be called from the event loop."""
+        if not key or not url or is_local(url):
+            return
+        with self.lock:
+            conn = self.connect()
+            conn.execute(
+                'INSERT INTO tracks (key, plays) VALUES (?, 1) '
+                'ON CONFLICT (key) DO UPDATE SET plays = plays + 1',
+                (key,)
+            )
+            conn.commit()
+            plays, digest = conn.execute('SELECT plays, digest FROM tracks WHERE key = ?', (key,)).fetchone()
+        if plays >= self.threshold and not digest and key not in self.downloading:
+            self.downloading.add(key)
+            asyncio.create_task(self.download(key, url))
+
+    def forget(self, key: str | None):
+        """Drop a track's copy, eg. when it fails to play."""
+        with self.lock:
+            conn = self.connect()
+            row = conn.execute('SELECT digest FROM tracks WHERE key = ?', (key,)).fetchone()
+            conn.execute('UPDATE tracks SET digest = NULL, size = NULL WHERE key = ?', (key,))
+            conn.commit()
+            if row and row[0]:
+                self.release(row[0])
+
+    async def download(self, key: str, url: str):
+        if self.workers is None:
+            self.workers = asyncio.Semaphore(DOWNLOAD_WORKERS)
+        temp = os.path.join(self.folder, f'{key}.part')
+        try:
+            async with self.workers:
+                await self.transcode(url, temp)
+            loop = asyncio.get_running_loop()
+            digest = await loop.run_in_executor(None, file_digest, temp)
+            path = self.path_of(digest)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(temp, path)
+            self.store(key, digest, os.path.getsize(path))
+            metrics.incr('audio_cache.downloads')
+        except Exception as e:
+            print(e)
+            metrics.incr('audio_cache.failed_downloads')
+        finally:
+            self.downloading.discard(key)
+            if os.path.exists(temp):
+                os.remove(temp)
+
+    async def transcode(self, url: str, path: str):
+        """Save a stream as ogg opus, copying it if it already is opus."""
+        codec = ['-c:a', 'copy'] if stream_codec(url) == 'opus' else ['-c:a', 'libopus', '-b:a', '128k']
+        # downloads are the least urgent, they wait as long as it takes
+        with await process_budget.wait(PRIORITY_PROBE, None):
+            await self.run_ffmpeg(url, path, codec)
+
+    async def run_ffmpeg(self, url: str, path: str, codec: list[str]):
+        process = await asyncio.create_subprocess_exec(
+            'ffmpeg', '-nostdin', '-loglevel', 'error', '-y',
+            *FFMPEG_OPTIONS['before_options'].split(),
+            '-i', url,
+            '-vn', '-map_metadata', '-1', *codec,
+            # same audio, same bytes, so copies share a digest
+            '-fflags', '+bitexact',
+            '-f', 'opus', path,
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.DEVNULL
+        )
+        try:
+            await asyncio.wait_for(process.wait(), DOWNLOAD_TIMEOUT)
+        except asyncio.TimeoutError:
+            process.kill()
+            await process.wait()
+            raise
+        if process.returncode != 0:
+            raise Exception(f'ffmpeg exited with {process.returncode}.')
+
+    def store(self, key: str, digest: str, size: int):
+        with self.lock:
+            conn = self.connect()
+            conn.execute(
+                'UPDATE tracks SET digest = ?, size = ?, used_at = ? WHERE key = ?',
+                (digest, size, time.time(), key)
+            )
+            conn.commit()
+            self.evict()
+
+    def evict(self):
+        """Remove the least recently played files until the cache fits. Needs the lock."""
+        conn = self.connect()
+        total = conn.execute(
+            'SELECT TOTAL(size) FROM (SELECT DISTINCT digest, size FROM tracks WHERE digest IS NOT NULL)'
+        ).fetchone()[0]
+        while total > self.max_size:
+            row = conn.execute(
+                'SELECT key, digest, size FROM tracks WHERE digest IS NOT NULL ORDER BY used_at LIMIT 1'
+            ).fetchone()
+            if not row:
+                break
+            key, digest, size = row
+            conn.execute('UPDATE tracks SET digest = NULL, size = NULL WHERE key = ?', (key,))
+            if self.release(digest):
+                total -= size
+            metrics.incr('audio_cache.evictions')
+        conn.commit()
+
+    def release(self, digest: str) -> bool:
+        """Remove a file no track uses anymore. Needs the lock."""
+        if self.connect().execute('SELECT 1 FROM tracks WHERE digest = ?', (digest,)).fetchone():
+            return False
+        path = self.path_of(digest)
+        if os.path.exists(path):
+            os.remove(path)
+        return True
+
+
+audio_cache = AudioCache()
@@ -0,0 +1,193 @@
+import threading
+import discord
+from typing import Callable, Hashable
+from .metrics import metrics
+
+# frames kept for listeners reading behind the first one, 10 seconds
+BROADCAST_FRAMES = 500
+
+
+class Broadcast:
+    """One upstream source read by many listeners.
+
+    Frames go into a ring buffer as the listener furthest ahead asks for them,
+    so the upstream is read at the pace of one player, and the other listeners
+    read them from the ring with their own cursor. A listener that falls out of
+    the ring skips ahead on a livestream, and ends otherwise, so its player can
+    reopen the song where it was.
+
+    Attributes
+    -----------
+    key: Hashable
+        What the broadcast plays, see :meth:`BroadcastHub.listen`.
+    original: :class:`discord.AudioSource`
+        The upstream source.
+    live: :class:`bool`
+        Whether it's a livestream, which listeners join at the latest frame.
+    ring: List[:class:`bytes`]
+        The latest frames.
+    head: :class:`int`
+        Frames read from the upstream so far.
+    listeners: :class:`int`
+        Listeners that haven't been cleaned up yet.
+    """
+
+    def __init__(self, key: Hashable, original: discord.AudioSource, live: bool = False, size: int = BROADCAST_FRAMES):
+        self.key = key
+        self.original = original
+        self.live = live
+        self.ring: list[bytes | None] = [None] * size
+        self.head = 0
+        self.ended = False
+        self.listeners = 0
+        self.lock = threading.Lock()
+        # held while reading the upstream, so only one listener waits on it
+        self.fetching = threading.Lock()
+        self.on_close: Callable[['Broadcast'], None] | None = None
+
+    @property
+    def joinable(self) -> bool:
+        """Whether a new listener would hear it from where it should, the start or live."""
+        return not self.ended and self.listeners > 0 and (self.live or self.head <= len(self.ring))
+
+    def join(self) -> 'BroadcastSource':
+        """Needs the lock."""
+        self.listeners += 1
+        return BroadcastSource(self, self.head if self.live else 0)
+
+    def leave(self):
+        with self.lock:
+            self.listeners -= 1
+            if self.listeners > 0:
+                return
+        # nobody can join once the listeners ran out
+        if self.on_close:
+            self.on_close(self)
+        self.original.cleanup()
+
+    def read(self, cursor: int) -> tuple[bytes, int | None]:
+        """The frame at cursor and the next cursor, empty if the listener is done.
+
+        The cursor is ``None`` if the listener fell out of the ring."""
+        size = len(self.ring)
+        with self.lock:
+            if cursor < self.head - size:
+                metrics.incr('broadcast.fell_behind')
+                if not self.live:
+                    return b'', None
+                cursor = self.head - size
+            if cursor < self.head:
+                return self.ring[cursor % size], cursor + 1
+        with self.fetching:
+            with self.lock:
+                # read by another listener while waiting
+                if cursor < self.head:
+                    return self.ring[cursor % size], cursor + 1
+                if self.ended:
+                    return b'', cursor
+            data = self.original.read()
+            with self.lock:
+                if not data:
+                    self.ended = True
+                    return b'', cursor
+                self.ring[self.head % size] = data
+                self.head += 1
+                return data, cursor + 1
+
+
+class BroadcastSource(discord.AudioSource):
+    """A listener's view of a :class:`Broadcast`.
+
+    Attributes
+    -----------
+    broadcast: :class:`Broadcast`
+        What it listens to.
+    cursor: :class:`int`
+        The frame it reads next.
+    fell_behind: :class:`bool`
+        Whether it ended by falling out of the ring, the stream itself is fine.
+    """
+
+    def __init__(self, broadcast: Broadcast, cursor: int):
+        self.broadcast = broadcast
+        self.cursor = cursor
+        self.closed = False
+        self.fell_behind = False
+
+    def read(self) -> bytes:
+        data, cursor = self.broadcast.read(self.cursor)
+        if cursor is None:
+            self.fell_behind = True
+        else:
+            self.cursor = cursor
+        return data
+
+    def is_opus(self) -> bool:
+        return self.broadcast.original.is_opus()
+
+    def cleanup(self):
+        if not self.closed:
+            self.closed = True
+            self.broadcast.leave()
+
+
+class BroadcastHub:
+    """The running broadcasts, so servers playing the same stream share one.
+
+    Attributes
+    -----------
+    broadcasts: Dict[Hashable,:class:`Broadcast`]
+        The joinable broadcast of each stream.
+    """
+
+    def __init__(self):
+        self.broadcasts: dict[Hashable, Broadcast] = {}
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.broadcasts)
+
+    def listen(self, key: Hashable, open_source: Callable[[], discord.AudioSource], live: bool = False) -> BroadcastSource:
+        """Join the broadcast of key, starting one with open_source if there's none to join.
+
+        Parameters
+        -----------
+        key: Hashable
+            Identifies the stream, sources with the same key have to be interchangeable.
+        open_source: Callable[[], :class:`discord.AudioSource`]
+            Creates the upstream source.
+        live: :class:`bool`
+            Whether the stream is live, later listeners start at its latest frame.
+        """
+        if source := self.join(key):
+            return source
+        # opening can wait for a process slot, so it's done without the lock
+        original = open_source()
+        if source := self.join(key):
+            # started by another server meanwhile
+            original.cleanup()
+            return source
+        broadcast = Broadcast(key, original, live)
+        broadcast.on_close = self.remove
+        with self.lock, broadcast.lock:
+            self.broadcasts[key] = broadcast
+            metrics.incr('broadcast.started')
+            return broadcast.join()
+
+    def join(self, key: Hashable) -> BroadcastSource | None:
+        with self.lock:
+            broadcast = self.broadcasts.get(key)
+            if broadcast:
+                with broadcast.lock:
+                    if broadcast.joinable:
+                        metrics.incr('broadcast.joined')
+                        return broadcast.join()
+        return None
+
+    def remove(self, broadcast: Broadcast):
+        with self.lock:
+            if self.broadcasts.get(broadcast.key) is broadcast:
+                del self.broadcasts[broadcast.key]
+
+
+broadcast_hub = BroadcastHub()
@@ -0,0 +1,97 @@
+import re
+import threading
+import time
+from collections import OrderedDict
+
+EXPIRE_PATTERN = re.compile(r'[?&/]expire[=/](\d+)')
+DURATION_PATTERN = re.compile(r'[?&/]dur[=/]([\d.]+)')
+VIDEO_ID_PATTERN = re.compile(
+    r'(?:[?&]v=|youtu\.be/|/shorts/|/embed/|/live/)([\w-]{11})'
+)
+
+
+def video_id(url: str | None) -> str | None:
+    """Get the youtube video id from a watch url."""
+    if not url:
+        return None
+    match = VIDEO_ID_PATTERN.search(url)
+    return match.group(1) if match else None
+
+
+def url_expiry(url: str | None) -> float | None:
+    """Get the unix time a googlevideo stream url stops working."""
+    if not url:
+        return None
+    match = EXPIRE_PATTERN.search(url)
+    return float(match.group(1)) if match else None
+
+
+def url_duration(url: str | None) -> float | None:
+    """Get the duration in seconds of the audio behind a googlevideo stream url."""
+    if not url:
+        return None
+    match = DURATION_PATTERN.search(url)
+    return float(match.group(1)) if match else None
+
+
+class StreamCache:
+    """LRU cache of resolved stream urls that drops entries before they expire.
+
+    Attributes
+    -----------
+    maxsize: :class:`int`
+        The maximum amount of urls kept.
+    margin: :class:`float`
+        Seconds before the url's expiry that it is considered stale.
+    ttl: :class:`float`
+        Lifetime of urls that don't carry an expiry.
+    """
+
+    def __init__(self, maxsize: int = 2048, margin: float = 600, ttl: float = 3600):
+        self.maxsize = maxsize
+        self.margin = margin
+        self.ttl = ttl
+        self.entries: OrderedDict[str, tuple[str, float]] = OrderedDict()
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def is_expired(self, url: str, now: float | None = None) -> bool:
+        expiry = url_expiry(url)
+        if expiry is None:
+            return False
+        now = time.time() if now is None else now
+        return expiry - self.margin <= now
+
+    def get(self, key: str | None) -> str | None:
+        if not key:
+            return None
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            url, expiry = entry
+            if expiry - self.margin <= now:
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return url
+
+    def put(self, key: str | None, url: str | None):
+        if not key or not url:
+            return
+        expiry = url_expiry(url) or time.time() + self.ttl
+        with self.lock:
+            self.entries[key] = (url, expiry)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def pop(self, key: str | None):
+        with self.lock:
+            self.entries.pop(key, None)
+
+
+stream_cache = StreamCache()
@@ -0,0 +1,327 @@
+import json
+import os
+import sqlite3
+from typing import Iterable, Iterator
+from .songqueue import SongQueue
+
+# directory holding the per server queue files
+QUEUE_DIR = 'queues'
+# songs kept in memory at the head of a disk backed queue
+QUEUE_WINDOW = 200
+# songs read from disk at a time while iterating
+QUEUE_CHUNK = 500
+
+
+def encode_song(song) -> str:
+    return json.dumps(song.to_record(), ensure_ascii=False, separators=(',', ':'))
+
+
+def decode_song(data: str):
+    from .music import Song
+    return Song.from_record(json.loads(data))
+
+
+class DiskQueue:
+    """Song queue that keeps its head in memory and spills the rest to sqlite.
+
+    Has the same interface as :class:`SongQueue`. The songs past the in-memory
+    window are rows ordered by a float key, so inserts and moves into the tail
+    only need the keys of their neighbours.
+
+    Attributes
+    -----------
+    filename: :class:`str`
+        The sqlite file holding the tail of the queue.
+    window: :class:`int`
+        How many songs are kept in memory.
+    head: :class:`SongQueue`
+        The songs at the front of the queue.
+    """
+
+    def __init__(self, filename: str, window: int = QUEUE_WINDOW):
+        self.filename = filename
+        self.window = window
+        self.head = SongQueue()
+        self.conn = sqlite3.connect(filename)
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS tracks ('
+            'ord REAL NOT NULL, '
+            'length REAL NOT NULL, '
+            'data TEXT NOT NULL)'
+        )
+        self.conn.execute('CREATE INDEX IF NOT EXISTS tracks_ord ON tracks (ord)')
+        # the queue doesn't outlive the bot, start from an empty one
+        self.conn.execute('DELETE FROM tracks')
+        self.conn.commit()
+        self.tail_len = 0
+        self.tail_length = 0.
+
+    def __len__(self):
+        return len(self.head) + self.tail_len
+
+    def __bool__(self):
+        return len(self) > 0
+
+    def __iter__(self) -> Iterator:
+        yield from list(self.head)
+        for offset in range(0, self.tail_len, QUEUE_CHUNK):
+            yield from self.tail_slice(offset, offset + QUEUE_CHUNK)
+
+    def __repr__(self):
+        return f'DiskQueue({self.filename!r}, {len(self)} songs)'
+
+    def index_range(self, pos: int) -> int:
+        length = len(self)
+        if pos < 0:
+            pos += length
+        if not 0 <= pos < length:
+            raise IndexError('queue index out of range')
+        return pos
+
+    # tail helpers, offsets are relative to the start of the tail
+
+    def tail_rows(self, start: int, stop: int) -> list[tuple[int, float, float, str]]:
+        if stop <= start:
+            return []
+        return self.conn.execute(
+            'SELECT rowid, ord, length, data FROM tracks ORDER BY ord LIMIT ? OFFSET ?',
+            (stop - start, start)
+        ).fetchall()
+
+    def tail_slice(self, start: int, stop: int) -> list:
+        return [decode_song(data) for *_, data in self.tail_rows(start, stop)]
+
+    def tail_ord(self, offset: int) -> float | None:
+        rows = self.tail_rows(offset, offset + 1)
+        return rows[0][1] if rows else None
+
+    def tail_insert(self, offset: int, songs: list):
+        if not songs:
+            return
+        before = self.tail_ord(offset - 1) if offset > 0 else None
+        after = self.tail_ord(offset)
+        if before is None and after is None:
+            before, after = 0., float(len(songs) + 1)
+        elif before is None:
+            before = after - len(songs) - 1
+        elif after is None:
+            after = before + len(songs) + 1
+        step = (after - before) / (len(songs) + 1)
+        if step < 1e-9:
+            self.renumber()
+            return self.tail_insert(offset, songs)
+        self.conn.executemany(
+            'INSERT INTO tracks VALUES (?, ?, ?)',
+            [
+                (before + step * (i + 1), song.length or 0., encode_song(song))
+                for i, song in enumerate(songs)
+            ]
+        )
+        self.conn.commit()
+        self.tail_len += len(songs)
+        self.tail_length += sum(song.length or 0. for song in songs)
+
+    def tail_delete(self, start: int, stop: int) -> list:
+        rows = self.tail_rows(start, stop)
+        self.conn.executemany(
+            'DELETE FROM tracks WHERE rowid = ?',
+            [(rowid,) for rowid, *_ in rows]
+        )
+        self.conn.commit()
+        self.tail_len -= len(rows)
+        self.tail_length -= sum(length for _, _, length, _ in rows)
+        return [decode_song(data) for *_, data in rows]
+
+    def renumber(self):
+        rowids = self.conn.execute('SELECT rowid FROM tracks ORDER BY ord').fetchall()
+        self.conn.executemany(
+            'UPDATE tracks SET ord = ? WHERE rowid = ?',
+            [(float(i), rowid) for i, (rowid,) in enumerate(rowids)]
+        )
+        self.conn.commit()
+
+    def spill(self, keep: int):
+        """Move the head's songs past keep to the front of the tail."""
+        if len(self.head) > keep:
+            songs = self.head[keep:]
+            del self.head[keep:]
+            self.tail_insert(0, songs)
+
+    def refill(self):
+        if self.tail_len and len(self.head) < self.window // 2:
+            self.head += self.tail_delete(0, self.window - len(self.head))
+
+    # list interface
+
+    def __getitem__(self, pos: int | slice):
+        if isinstance(pos, slice):
+            start, stop, step = pos.indices(len(self))
+            if step != 1:
+                return list(self)[pos]
+            if start >= stop:
+                return []
+            head_len = len(self.head)
+            songs = self.head[start:min(stop, head_len)] if start < head_len else []
+            if stop > head_len:
+                songs += self.tail_slice(max(0, start - head_len), stop - head_len)
+            return songs
+        pos = self.index_range(pos)
+        if pos < len(self.head):
+            return self.head[pos]
+        return self.tail_slice(pos - len(self.head), pos - len(self.head) + 1)[0]
+
+    def __setitem__(self, pos: int | slice, value):
+        if isinstance(pos, slice):
+            start, stop, step = pos.indices(len(self))
+            if step != 1:
+                raise ValueError('queue slices can\'t have a step')
+            del self[start:stop]
+            self.insert_many(start, list(value))
+            return
+        pos = self.index_range(pos)
+        if pos < len(self.head):
+            self.head[pos] = value
+            return
+        rowid, _, length, _ = self.tail_rows(pos - len(self.head), pos - len(self.head) + 1)[0]
+        self.conn.execute(
+            'UPDATE tracks SET length = ?, data = ? WHERE rowid = ?',
+            (value.length or 0., encode_song(value), rowid)
+        )
+        self.conn.commit()
+        self.tail_length += (value.length or 0.) - length
+
+    def __delitem__(self, pos: int | slice):
+        if isinstance(pos, slice):
+            start, stop, step = pos.indices(len(self))
+            if step != 1:
+                for index in sorted(range(start, stop, step), reverse=True):
+                    self.pop(index)
+                return
+            if start >= stop:
+                return
+            head_len = len(self.head)
+            if stop > head_len:
+                self.tail_delete(max(0, start - head_len), stop - head_len)
+            if start < head_len:
+                del self.head[start:min(stop, head_len)]
+            self.refill()
+            return
+        self.pop(pos)
+
+    def __iadd__(self, songs: Iterable):
+        self.extend(songs)
+        return self
+
+    def insert_many(self, pos: int, songs: list):
+        head_len = len(self.head)
+        if pos <= head_len:
+            self.head[pos:pos] = songs
+            self.spill(self.window)
+        else:
+            self.tail_insert(pos - head_len, songs)
+
+    def append(self, song):
+        self.extend((song,))
+
+    def extend(self, songs: Iterable):
+        songs = list(songs)
+        if not self.tail_len:
+            room = max(0, self.window - len(self.head))
+            self.head += songs[:room]
+            songs = songs[room:]
+        self.tail_insert(self.tail_len, songs)
+
+    def insert(self, pos: int, song):
+        length = len(self)
+        if pos < 0:
+            pos = max(0, pos + length)
+        self.insert_many(min(pos, length), [song])
+
+    def pop(self, pos: int = -1):
+        pos = self.index_range(pos)
+        if pos < len(self.head):
+            song = self.head.pop(pos)
+        else:
+            song = self.tail_delete(pos - len(self.head), pos - len(self.head) + 1)[0]
+        self.refill()
+        return song
+
+    def find(self, song) -> int:
+        """Position of this song in the queue, -1 if it isn't queued.
+
+        Falls back to matching by value, since songs that went through the disk
+        are copies."""
+        pos = self.head.find(song)
+        if pos != -1 or song is None:
+            return pos
+        # songs read back from disk are copies of the queued ones
+        record = song.to_record()
+        for pos, queued in enumerate(self.head):
+            if queued.to_record() == record:
+                return pos
+        row = self.conn.execute(
+            'SELECT ord FROM tracks WHERE data = ? ORDER BY ord DESC LIMIT 1',
+            (encode_song(song),)
+        ).fetchone()
+        if not row:
+            return -1
+        before = self.conn.execute(
+            'SELECT COUNT(*) FROM tracks WHERE ord < ?',
+            (row[0],)
+        ).fetchone()[0]
+        return len(self.head) + before
+
+    def clear(self):
+        self.head.clear()
+        self.conn.execute('DELETE FROM tracks')
+        self.conn.commit()
+        self.tail_len = 0
+        self.tail_length = 0.
+
+    def reverse(self):
+        self.spill(0)
+        self.conn.execute('UPDATE tracks SET ord = -ord')
+        self.conn.commit()
+        self.refill()
+
+    def shuffle(self):
+        self.spill(0)
+        self.conn.execute('UPDATE tracks SET ord = random()')
+        self.conn.commit()
+        self.refill()
+
+    def move(self, _from: int, _to: int):
+        self.insert(_to, self.pop(_from))
+
+    def swap(self, pos1: int, pos2: int):
+        pos1, pos2 = self.index_range(pos1), self.index_range(pos2)
+        song1, song2 = self[pos1], self[pos2]
+        self[pos1], self[pos2] = song2, song1
+
+    def wait_time(self, pos: int) -> float:
+        """Total duration of the songs before a position, in seconds."""
+        pos = max(0, min(pos, len(self)))
+        head_len = len(self.head)
+        waited = self.head.wait_time(min(pos, head_len))
+        if pos > head_len:
+            waited += self.conn.execute(
+                'SELECT TOTAL(length) FROM (SELECT length FROM tracks ORDER BY ord LIMIT ?)',
+                (pos - head_len,)
+            ).fetchone()[0]
+        return waited
+
+    @property
+    def duration(self) -> float:
+        return self.head.duration + self.tail_length
+
+    def close(self):
+        self.conn.close()
+        os.remove(self.filename)
+
+
+def make_queue(guild_id: int) -> SongQueue | DiskQueue:
+    """Create a server's queue with the backend set by QUEUE_BACKEND."""
+    if os.getenv('QUEUE_BACKEND', 'memory') == 'disk':
+        os.makedirs(QUEUE_DIR, exist_ok=True)
+        return DiskQueue(os.path.join(QUEUE_DIR, f'{guild_id}.db'))
+    return SongQueue()
@@ -0,0 +1,125 @@
+import re
+import sqlite3
+import threading
+import time
+from difflib import SequenceMatcher
+from .metrics import metrics
+from .spotify import spotify_id
+
+MATCH_DB = 'matches.db'
+# youtube search results compared against each spotify track
+MATCH_CANDIDATES = 5
+# seconds of duration difference at which a candidate scores nothing for length
+DURATION_TOLERANCE = 20
+# words that usually mean a different recording than the one on spotify
+MISMATCH_WORDS = ('live', 'cover', 'remix', 'karaoke', 'instrumental', 'nightcore', 'slowed', 'sped up', '8d')
+
+
+def normalize(title: str) -> str:
+    return ' '.join(re.sub(r'[^\w\s]', ' ', title.lower()).split())
+
+
+def match_score(title: str, duration: float, candidate_title: str, candidate_duration: float | None) -> float:
+    """How likely a youtube result is the spotify track, from 0 to 1."""
+    title = normalize(title)
+    candidate_title = normalize(candidate_title)
+    similarity = SequenceMatcher(None, title, candidate_title).ratio()
+    if candidate_duration:
+        delta = abs(candidate_duration - duration)
+        length = max(0., 1 - delta / DURATION_TOLERANCE)
+    else:
+        length = 0.
+    score = .6 * length + .4 * similarity
+    # padded so phrases like sped up match whole words only
+    title, candidate_title = f' {title} ', f' {candidate_title} '
+    for word in MISMATCH_WORDS:
+        if f' {word} ' in candidate_title and f' {word} ' not in title:
+            score -= .15
+    return score
+
+
+class MatchTable:
+    """Persistent table of which youtube video plays a spotify track.
+
+    Attributes
+    -----------
+    filename: :class:`str`
+        The sqlite database file.
+    """
+
+    def __init__(self, filename: str = MATCH_DB):
+        self.filename = filename
+        self.conn: sqlite3.Connection | None = None
+        self.lock = threading.Lock()
+
+    def connect(self) -> sqlite3.Connection:
+        if self.conn is None:
+            self.conn = sqlite3.connect(self.filename, check_same_thread=False)
+            self.conn.execute(
+                'CREATE TABLE IF NOT EXISTS matches ('
+                'spotify_id TEXT PRIMARY KEY, '
+                'video_id TEXT NOT NULL, '
+                'score REAL, '
+                'matched_at REAL)'
+            )
+            self.conn.commit()
+        return self.conn
+
+    def get(self, spotify_id: str) -> str | None:
+        with self.lock:
+            row = self.connect().execute(
+                'SELECT video_id FROM matches WHERE spotify_id = ?',
+                (spotify_id,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def put(self, spotify_id: str, video_id: str, score: float):
+        with self.lock:
+            conn = self.connect()
+            conn.execute(
+                'INSERT OR REPLACE INTO matches VALUES (?, ?, ?, ?)',
+                (spotify_id, video_id, score, time.time())
+            )
+            conn.commit()
+
+    def forget(self, spotify_id: str):
+        with self.lock:
+            conn = self.connect()
+            conn.execute('DELETE FROM matches WHERE spotify_id = ?', (spotify_id,))
+            conn.commit()
+
+
+match_table = MatchTable()
+
+
+def forget_match(song):
+    """Drop a spotify song's match, eg. once its video can't be played anymore."""
+    if key := spotify_id(song.spurl):
+        match_table.forget(key)
+        metrics.incr('matcher.forgotten')
+
+
+def match_spotify(song) -> str:
+    """Find the youtube url of a spotify song, searching only on a table miss."""
+    from .search import get_ytdl
+    key = spotify_id(song.spurl)
+    if key and (video_id := match_table.get(key)):
+        metrics.incr('matcher.hits')
+        return f'https://www.youtube.com/watch?v={video_id}'
+    metrics.incr('matcher.searches')
+    data = get_ytdl().extract_info(
+        f'ytsearch{MATCH_CANDIDATES}:{song.title}',
+        download=False,
+        process=False
+    )
+    candidates = [entry for entry in data['entries'] if entry.get('id')]
+    if not candidates:
+        raise Exception(f'No youtube match for {song.title}.')
+    scores = [
+        match_score(song.title, song.length, entry.get('title') or '', entry.get('duration'))
+        for entry in candidates
+    ]
+    best = max(range(len(candidates)), key=scores.__getitem__)
+    if key:
+        match_table.put(key, candidates[best]['id'], scores[best])
+    return f'https://www.youtube.com/watch?v={candidates[best]["id"]}'
@@ -0,0 +1,64 @@
+import threading
+from collections import deque
+
+# how many recent samples are kept per timing
+METRIC_SAMPLES = 512
+
+
+class Metrics:
+    """Thread-safe counters and recent timing samples.
+
+    Attributes
+    -----------
+    counters: Dict[:class:`str`,:class:`float`]
+        Running totals, eg. how many tracks failed to load.
+    timings: Dict[:class:`str`,Deque[:class:`float`]]
+        The latest samples of each timing, in seconds.
+    """
+
+    def __init__(self, samples: int = METRIC_SAMPLES):
+        self.samples = samples
+        self.counters: dict[str, float] = {}
+        self.timings: dict[str, deque[float]] = {}
+        self.lock = threading.Lock()
+
+    def incr(self, name: str, amount: float = 1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def observe(self, name: str, value: float):
+        with self.lock:
+            if name not in self.timings:
+                self.timings[name] = deque(maxlen=self.samples)
+            self.timings[name].append(value)
+
+    def summary(self, name: str) -> dict[str, float] | None:
+        with self.lock:
+            samples = sorted(self.timings.get(name, ()))
+        if not samples:
+            return None
+        return {
+            'count': len(samples),
+            'mean': sum(samples) / len(samples),
+            'p50': samples[len(samples) // 2],
+            'p95': samples[min(len(samples) - 1, int(len(samples) * .95))],
+            'max': samples[-1],
+        }
+
+    def report(self) -> str:
+        lines = []
+        for name in sorted(self.counters):
+            lines.append(f'{name}: {self.counters[name]:g}')
+        for name in sorted(self.timings):
+            summary = self.summary(name)
+            if summary:
+                lines.append(
+                    f'{name}: n={summary["count"]} '
+                    f'p50={summary["p50"]*1000:.0f}ms '
+                    f'p95={summary["p95"]*1000:.0f}ms '
+                    f'max={summary["max"]*1000:.0f}ms'
+                )
+        return '\n'.join(lines)
+
+
+metrics = Metrics()
@@ -0,0 +1,190 @@
+import threading
+import discord
+import numpy as np
+
+# samples per channel in a 20ms frame at 48kHz
+FRAME_SAMPLES = 960
+CHANNELS = 2
+# frames a volume change is spread over so it doesn't click
+VOLUME_RAMP = 5
+# seconds of fade in after a seek
+FADE_SECONDS = 1.
+# seconds the outgoing song keeps playing under the next one after a skip
+CROSSFADE_SECONDS = 3.
+# gain of the song while another source is mixed over it
+DUCK_GAIN = .3
+
+
+def seconds_to_frames(seconds: float) -> int:
+    return max(1, int(seconds / .02))
+
+
+class Fader:
+    """Gain that moves linearly to a target over a number of frames."""
+    __slots__ = ('gain', 'target', 'steps')
+
+    def __init__(self, gain: float = 1.):
+        self.gain = gain
+        self.target = gain
+        self.steps = 0
+
+    def set(self, target: float, frames: int = 0):
+        self.target = target
+        self.steps = frames
+        if frames <= 0:
+            self.gain = target
+
+    def step(self) -> tuple[float, float]:
+        """The gain at the start and end of the next frame."""
+        start = self.gain
+        if self.steps > 0:
+            self.gain += (self.target - self.gain) / self.steps
+            self.steps -= 1
+        return start, self.gain
+
+
+class Layer:
+    __slots__ = ('source', 'fader', 'fading_out')
+
+    def __init__(self, source: discord.AudioSource, fader: Fader, fading_out: bool):
+        self.source = source
+        self.fader = fader
+        self.fading_out = fading_out
+
+
+# 0 to 1 over a frame, scaled into gain ramps
+RAMP = np.linspace(0., 1., FRAME_SAMPLES, dtype=np.float32)[:, None]
+
+
+def to_samples(data: bytes) -> np.ndarray:
+    """View a pcm frame as samples, padding a short last frame with silence."""
+    samples = np.frombuffer(data, dtype=np.int16)
+    if len(samples) < FRAME_SAMPLES * CHANNELS:
+        samples = np.pad(samples, (0, FRAME_SAMPLES * CHANNELS - len(samples)))
+    return samples.reshape(-1, CHANNELS)
+
+
+def gain_of(start: float, end: float) -> float | np.ndarray:
+    """A constant gain, or a per sample ramp if it changes during the frame."""
+    if start == end:
+        return np.float32(start)
+    return RAMP * np.float32(end - start) + np.float32(start)
+
+
+class MixerSource(discord.AudioSource):
+    """PCM source with volume, fades, crossfades and ducking.
+
+    Frames pass through untouched while the gain is 1.0 and nothing is mixed in,
+    otherwise every frame is scaled and summed into a preallocated buffer, and
+    only clipped when the gains could overflow.
+
+    Attributes
+    -----------
+    source: :class:`discord.AudioSource`
+        The song's pcm source.
+    fader: :class:`Fader`
+        The song's volume.
+    duck: :class:`Fader`
+        Lowers the song while an overlay plays.
+    layers: List[:class:`Layer`]
+        Sources mixed over the song, eg. the outgoing song of a crossfade.
+    """
+
+    def __init__(self, source: discord.AudioSource, volume: float = 1.):
+        self.source: discord.AudioSource | None = source
+        self.fader = Fader(volume)
+        self.duck = Fader()
+        self.layers: list[Layer] = []
+        self.lock = threading.Lock()
+        self.buffer = np.empty((FRAME_SAMPLES, CHANNELS), dtype=np.float32)
+        self.scratch = np.empty((FRAME_SAMPLES, CHANNELS), dtype=np.float32)
+
+    @property
+    def volume(self) -> float:
+        return self.fader.target
+
+    @volume.setter
+    def volume(self, volume: float):
+        with self.lock:
+            self.fader.set(volume, VOLUME_RAMP)
+
+    def fade_in(self, seconds: float = FADE_SECONDS):
+        with self.lock:
+            volume = self.fader.target
+            self.fader.set(0.)
+            self.fader.set(volume, seconds_to_frames(seconds))
+
+    def crossfade_from(self, outgoing: discord.AudioSource, seconds: float = CROSSFADE_SECONDS):
+        """Fade the outgoing source out while this one fades in."""
+        frames = seconds_to_frames(seconds)
+        fader = Fader(self.fader.target)
+        fader.set(0., frames)
+        self.fade_in(seconds)
+        with self.lock:
+            self.layers.append(Layer(outgoing, fader, True))
+
+    def overlay(self, source: discord.AudioSource, gain: float = 1., duck: float = DUCK_GAIN):
+        """Mix a source over the song, which is ducked until it ends."""
+        with self.lock:
+            self.layers.append(Layer(source, Fader(gain), False))
+            self.duck.set(duck, VOLUME_RAMP)
+
+    def detach(self) -> discord.AudioSource | None:
+        """Take the song's source out so it can keep playing elsewhere, this ends the mixer."""
+        with self.lock:
+            source, self.source = self.source, None
+            return source
+
+    def read(self) -> bytes:
+        with self.lock:
+            source = self.source
+            layers = self.layers[:]
+        if source is None:
+            return b''
+        # pipe reads can block for seconds, the lock only guards the mixer's state
+        data = source.read()
+        if not data:
+            return b''
+        layer_frames = [layer.source.read() for layer in layers]
+        with self.lock:
+            if self.source is not source:  # detached meanwhile
+                return b''
+            start, end = self.fader.step()
+            duck_start, duck_end = self.duck.step()
+            start, end = start * duck_start, end * duck_end
+            if start == end == 1. and not self.layers:
+                return data
+            frame = self.buffer
+            np.multiply(to_samples(data), gain_of(start, end), out=frame)
+            peak = max(start, end)
+            for layer, layer_data in zip(layers, layer_frames):
+                if layer not in self.layers:  # cleaned up meanwhile
+                    continue
+                layer_start, layer_end = layer.fader.step()
+                if layer_data:
+                    np.multiply(to_samples(layer_data), gain_of(layer_start, layer_end), out=self.scratch)
+                    frame += self.scratch
+                    peak += max(layer_start, layer_end)
+                if not layer_data or (layer.fading_out and layer.fader.gain <= 0.):
+                    self.remove_layer(layer)
+            if peak > 1.:
+                np.clip(frame, -32768, 32767, out=frame)
+            return frame.astype(np.int16).tobytes()
+
+    def remove_layer(self, layer: Layer):
+        self.layers.remove(layer)
+        layer.source.cleanup()
+        if all(other.fading_out for other in self.layers):
+            self.duck.set(1., VOLUME_RAMP)
+
+    def is_opus(self) -> bool:
+        return False
+
+    def cleanup(self):
+        with self.lock:
+            for layer in self.layers:
+                layer.source.cleanup()
+            self.layers.clear()
+            if self.source:
+                self.source.cleanup()
+                self.source = None
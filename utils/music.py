@@ -1,13 +1,36 @@
 import discord
 from discord.ui import View, Button
+import asyncio
 import numpy as np
+from collections import deque
+import sys
+import time
 from dataclasses import dataclass, field
-from datetime import datetime, timedelta
+from datetime import timedelta
+from .audio import audio_source, is_local
+from .processes import PRIORITY_LIVE, ProcessSlot
+from .audiocache import audio_cache
+from .cache import stream_cache, url_duration, video_id
+from .matcher import forget_match, match_spotify
+from .songqueue import SongQueue
+from .diskqueue import DiskQueue
+from .playorder import PlayOrder
 
 SILVER: discord.Color = discord.Color.from_rgb(r=203, g=213, b=225)
 
+# how many track transitions are remembered per server
+TRANSITION_SAMPLES = 50
 
-@dataclass(eq=True, order=True)
+
+def parse_timestamp(timestr: str) -> int:
+    """Seconds in a hh:mm:ss, mm:ss or ss timestamp."""
+    ftr = [1, 60, 3600]
+    timelist = timestr.split(':')
+    timelist.reverse()
+    return sum([a * b for a, b in zip(ftr, map(int, timelist))])
+
+
+@dataclass(eq=True, order=True, slots=True)
 class Time:
     value: float
 
@@ -50,9 +73,47 @@ class Playlist:
     thumbnail: str
     duration: Time
     track_num: int
+    loaded: int | None = None
+    pending: 'PlaylistCursor | None' = field(default=None, repr=False)
 
+    def to_record(self) -> list:
+        """Compact form of the playlist without its cursor."""
+        return [self.title, self.url, self.thumbnail, self.duration.value, self.track_num, self.loaded]
 
-@dataclass
+    @classmethod
+    def from_record(cls, record: list) -> 'Playlist':
+        title, url, thumbnail, duration, track_num, loaded = record
+        return cls(title, url, thumbnail, Time(duration), track_num, loaded)
+
+    @property
+    def is_loading(self) -> bool:
+        if self.pending:
+            return True
+        return self.loaded is not None and self.loaded < self.track_num
+
+
+@dataclass(slots=True)
+class PlaybackState:
+    """Progress of the song that is currently playing.
+
+    Attributes
+    -----------
+    start_time: :class:`float`
+        Monotonic time of when the song started or resumed playing.
+    delta: :class:`float`
+        Seconds played before start_time.
+    source: :class:`discord.AudioSource`
+        A source prepared ahead of time, eg. by seek.
+    recoveries: :class:`int`
+        How many times the song was resumed after its stream broke off.
+    """
+    start_time: float = field(default_factory=time.monotonic)
+    delta: float = 0.
+    source: discord.AudioSource | None = None
+    recoveries: int = 0
+
+
+@dataclass(slots=True)
 class Song:
     """Represents a Song.
 
@@ -64,48 +125,81 @@ class Song:
         The song title.
     thumbnail: :class:`str`
         The thumbnail url.
-    duration: :class:`Time`
-        The song's duration.
+    length: :class:`float`
+        The song's duration in seconds, see :attr:`duration`.
     yturl: :class:`str`
         The url from youtube.
     spurl: :class:`str`
         The url from spotify.
     url: :class:`str`
         The song's audio file url.
-    source: :class:`discord.FFmpegPCMAudio`
-        The source for playing the song.
-    start_time: :class:`datetime`
-        Store when the song start playing.
-    delta: :class:`float`
-        To track the song's progress.
+    state: :class:`PlaybackState`
+        The playback progress, only kept while the song is playing.
+    requested_at: :class:`float`
+        Monotonic time of the command that started the player with this song.
+    stream_length: :class:`float`
+        Duration of the resolved stream, a spotify song's length is spotify's.
+    refresh: :class:`bool`
+        Whether the url was found broken, so caches must not hand it out again.
     """
     type: str
     title: str
-    thumbnail: str
-    duration: Time
+    thumbnail: str | None
+    length: float
     yturl: str | None = None
     spurl: str | None = None
     url: str | None = None
-    source: discord.FFmpegPCMAudio | None = None
-    start_time: datetime = datetime.now()
-    delta: float = 0.
+    state: PlaybackState | None = field(default=None, repr=False)
+    requested_at: float | None = field(default=None, repr=False, compare=False)
+    stream_length: float | None = field(default=None, repr=False, compare=False)
+    refresh: bool = field(default=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        if self.thumbnail:
+            self.thumbnail = sys.intern(self.thumbnail)
+
+    def to_record(self) -> list:
+        """Compact form of the song without its playback state."""
+        return [self.type, self.title, self.thumbnail, self.length, self.yturl, self.spurl, self.url]
+
+    @classmethod
+    def from_record(cls, record: list) -> 'Song':
+        return cls(*record)
+
+    @property
+    def duration(self) -> Time:
+        return Time(self.length)
+
+    @property
+    def playback(self) -> PlaybackState:
+        if self.state is None:
+            self.state = PlaybackState()
+        return self.state
+
+    def release(self):
+        """Drop the playback progress once the song stops being current."""
+        self.state = None
+
+    @property
+    def source(self) -> discord.AudioSource | None:
+        return self.state.source if self.state else None
+
+    @source.setter
+    def source(self, source: discord.AudioSource | None):
+        self.playback.source = source
 
     def reset_time(self):
-        self.start_time = datetime.now()
+        self.playback.start_time = time.monotonic()
 
     def save_progress(self):
-        delta = datetime.now() - self.start_time
-        self.delta = delta.total_seconds()
+        self.playback.delta = self.progress.value
+        self.reset_time()
 
     def set_progress(self, seconds: float):
-        self.delta = seconds
+        self.playback.delta = seconds
 
     def set_progress_str(self, timestr: str):
-        ftr = [1, 60, 3600]
-        timelist = timestr.split(':')
-        timelist.reverse()
-        seconds = sum([a * b for a, b in zip(ftr, map(int, timelist))])
-        self.delta = seconds
+        self.playback.delta = parse_timestamp(timestr)
 
     @property
     def progress_bar(self, width: int = 17, fill: str = '▬', url: str = 'https://anilist.co/character/89576/Sagiri-Izumi'):
@@ -124,9 +218,9 @@ class Song:
 
     @property
     def progress(self) -> Time:
-        delta = datetime.now() - self.start_time
-        delta = delta.total_seconds() + self.delta
-        return Time(delta)
+        if self.state is None:
+            return Time(0)
+        return Time(time.monotonic() - self.state.start_time + self.state.delta)
 
     @property
     def links(self):
@@ -150,30 +244,102 @@ class Song:
         else:
             return self.url
 
+    @property
+    def is_resolved(self) -> bool:
+        if self.type == 'file':
+            return True
+        return bool(self.url) and not stream_cache.is_expired(self.url)
+
+    @property
+    def is_local(self) -> bool:
+        return self.type != 'file' and bool(self.url) and is_local(self.url)
+
+    @property
+    def expected_length(self) -> float | None:
+        """How long the stream should play, None if that isn't known."""
+        if self.stream_length:
+            return self.stream_length
+        # youtube and file songs carry their own duration
+        if self.type != 'spotify' and self.length:
+            return self.length
+        return None
+
+    def invalidate(self):
+        """Forget the stream url so the next extraction resolves it again.
+
+        Only call it once opening the url failed, a local copy is dropped from
+        the audio cache."""
+        if self.type == 'file':
+            return
+        if self.is_local:
+            audio_cache.forget(video_id(self.yturl))
+        stream_cache.pop(video_id(self.yturl))
+        self.url = None
+        self.stream_length = None
+        # the resolver service keeps its own cache
+        self.refresh = True
+
+    def use_cached(self) -> bool:
+        """Point the song at its local copy if the audio cache has one."""
+        if self.type == 'file':
+            return False
+        if path := audio_cache.get(video_id(self.yturl)):
+            self.url = path
+        return bool(path)
+
     def extract_url(self):
-        from .search import ytdl, Youtube
-        if self.url:
-            pass
-        elif self.type == 'file':
-            pass
-        elif self.type == 'spotify':
-            data = ytdl.extract_info(self.title, download=False, process=True)
-            self.yturl = data['entries'][0]['webpage_url']
-            self.url = data['entries'][0]['url']
-        elif self.type == 'youtube':
-            data = ytdl.extract_info(self.yturl, download=False, process=False)
-            self.url = Youtube.get_url_from_formats(data['formats'])
-
-    def extract_source(self) -> discord.FFmpegPCMAudio:
-        from .search import FFMPEG_OPTIONS
+        from .remote import remote_resolver
+        from .search import extract_stream
+        if self.use_cached() or self.is_resolved:
+            return
+        remote = remote_resolver()
+        if self.type == 'spotify' and not self.yturl:
+            self.yturl = remote.match(self) if remote else match_spotify(self)
+            if self.use_cached():
+                return
+        if url := stream_cache.get(video_id(self.yturl)):
+            self.url = url
+            self.stream_length = url_duration(url)
+            return
+        try:
+            self.url, length = remote.stream(self.yturl, self.refresh) if remote else extract_stream(self.yturl)
+        except Exception:
+            if self.type == 'spotify':
+                # the matched video may be removed or private, the next attempt matches again
+                self.yturl = None
+                if remote:
+                    remote.forget_match(self)
+                else:
+                    forget_match(self)
+            raise
+        self.stream_length = float(length) if length else url_duration(self.url)
+        if not self.length and self.stream_length:
+            self.length = self.stream_length
+        stream_cache.put(video_id(self.yturl), self.url)
+        self.refresh = False
+
+    def extract_source(
+        self,
+        volume: float = 1.,
+        start: float | None = None,
+        priority: int = PRIORITY_LIVE,
+        slot: ProcessSlot | None = None
+    ) -> discord.AudioSource:
         if self.source:
             source = self.source
-            self.source = None
-        else:
-            if not self.url:
-                self.extract_url()
-            source = discord.FFmpegPCMAudio(self.url, **FFMPEG_OPTIONS)
-        return source
+            self.state.source = None
+            if slot:
+                slot.release()
+            return source
+        try:
+            self.extract_url()
+        except Exception:
+            if slot:
+                slot.release()
+            raise
+        # livestreams come without a duration
+        live = not self.length and self.type != 'file'
+        return audio_source(self.url, volume, start, live, priority, slot)
 
 
 @dataclass
@@ -182,8 +348,10 @@ class ServerMusic:
 
     Attributes
     -----------
-    queue: List[:class:`Song`]
-        The song queue.
+    guild_id: :class:`int`
+        The id of the server.
+    queue: :class:`SongQueue`
+        The song queue, a :class:`PlayOrder` over it while shuffled.
     vc: :class:`discord.VoiceClient`
         The voice client of the server.
     is_playing: :class:`bool`
@@ -194,34 +362,124 @@ class ServerMusic:
         The queue messages in the server.
     now_playing: :class:`discord.Message`
         The now playing message.
+    prefetcher: :class:`Prefetcher`
+        Resolves the next songs in the queue ahead of time.
+    prewarmer: :class:`Prewarmer`
+        Starts the next song's source before the current one ends.
+    supervisor: :class:`Supervisor`
+        Watches the playing stream and resumes it if it breaks off.
+    player: :class:`asyncio.Task`
+        The task playing through the queue.
+    events: :class:`asyncio.Queue`
+        Player events, eg. track ended, skip, stop.
+    transitions: Deque[:class:`float`]
+        Seconds of silence between the recent songs.
+    feeders: List[:class:`PlaylistCursor`]
+        Playlists whose remaining songs are extracted as the queue drains.
+    feeding: :class:`asyncio.Task`
+        The running extraction of a feeder's next window.
+    outgoing: :class:`discord.AudioSource`
+        A skipped song's audio, faded out under the next song.
+    generation: :class:`int`
+        Bumped by every clear, so playlists still loading know to stop.
     """
-    queue: list[Song] = field(default_factory=list)
+    guild_id: int | None = None
+    queue: SongQueue | DiskQueue | PlayOrder = field(default_factory=SongQueue)
     vc: discord.VoiceClient = None
     is_playing: bool = False
     current_song: Song | None = None
     queue_msg: dict[int, discord.Message] = field(default_factory=dict)
     now_playing: discord.Message = None
+    prefetcher: 'Prefetcher' = field(init=False, repr=False)
+    prewarmer: 'Prewarmer' = field(init=False, repr=False)
+    supervisor: 'Supervisor' = field(init=False, repr=False)
+    player: asyncio.Task | None = None
+    events: asyncio.Queue = field(default_factory=asyncio.Queue)
+    transitions: deque[float] = field(
+        default_factory=lambda: deque(maxlen=TRANSITION_SAMPLES)
+    )
+    feeders: list['PlaylistCursor'] = field(default_factory=list)
+    feeding: asyncio.Task | None = None
+    outgoing: discord.AudioSource | None = None
+    generation: int = 0
+
+    def __post_init__(self):
+        from .player import Prefetcher, Prewarmer, Supervisor
+        self.prefetcher = Prefetcher(self)
+        self.prewarmer = Prewarmer(self)
+        self.supervisor = Supervisor(self)
 
     def __len__(self):
         return len(self.queue)
 
+    def retarget(self):
+        """Let the prefetcher and prewarmer know the head of the queue changed."""
+        self.prefetcher.retarget()
+        self.prewarmer.retarget()
+
+    def post(self, event: str):
+        """Send an event to the player. Has to be called from the event loop."""
+        self.events.put_nowait(event)
+
+    def enqueue(self, songs: list[Song]):
+        self.queue += songs
+        self.retarget()
+
+    def insert(self, pos: int, songs: list[Song]):
+        self.queue[pos:pos] = songs
+        self.retarget()
+
+    def index(self, song: Song | None) -> int:
+        """Position of this exact song in the queue, -1 if it isn't queued."""
+        return self.queue.find(song)
+
+    def drop_outgoing(self):
+        if self.outgoing:
+            self.outgoing.cleanup()
+            self.outgoing = None
+
     def clear(self):
+        self.generation += 1
+        self.unshuffle()
         self.queue.clear()
+        self.feeders.clear()
+        self.prefetcher.cancel()
+        self.prewarmer.cancel_timer()
+        self.prewarmer.discard()
+        self.drop_outgoing()
+
+    @property
+    def is_shuffled(self) -> bool:
+        return isinstance(self.queue, PlayOrder)
 
     def shuffle(self):
-        np.random.shuffle(self.queue)
+        """Shuffle the play order, the original order is kept for unshuffle."""
+        if self.is_shuffled:
+            self.queue.shuffle()
+        else:
+            self.queue = PlayOrder(self.queue)
+        self.retarget()
+
+    def unshuffle(self):
+        if self.is_shuffled:
+            self.queue = self.queue.base
+            self.retarget()
 
-    def remove(self, pos: int):
+    def remove(self, pos: int | slice):
         del self.queue[pos]
+        self.retarget()
 
     def move(self, _from: int, _to: int):
-        self.queue.insert(_to, self.queue.pop(_from))
+        self.queue.move(_from, _to)
+        self.retarget()
 
     def swap(self, pos1: int, pos2: int):
-        self.queue[pos1], self.queue[pos2] = self.queue[pos2], self.queue[pos1]
+        self.queue.swap(pos1, pos2)
+        self.retarget()
 
     def reverse(self):
         self.queue.reverse()
+        self.retarget()
 
 
 class QueueEmbed:
@@ -293,6 +551,8 @@ class QueueEmbed:
         for i, song in enumerate(songs):
             text += f'{first_num+i}. {song.title} [{song.duration}]\n'
         footer = f'Page {self.page}/{page_len}'
+        if self.server_music.is_shuffled:
+            footer += ' | Shuffled'
         embed = discord.Embed(description=text, color=SILVER)
         embed.set_footer(text=footer)
         return embed
@@ -0,0 +1,397 @@
+import asyncio
+import threading
+import time
+import discord
+from typing import Awaitable, Callable
+from .audio import PREBUFFER_FRAMES, BufferedSource, buffered
+from .metrics import metrics
+from .music import ServerMusic, Song
+from .processes import PRIORITY_LIVE, PRIORITY_PREFETCH, PROCESS_WAIT, BudgetTimeout, ProcessSlot, process_budget
+from .scheduler import LANE_BACKGROUND, LANE_INTERACTIVE
+from .search import run_in_resolver
+
+# how many upcoming songs get their stream url resolved ahead of time
+PREFETCH_DEPTH = 3
+# a lazily loaded playlist extracts its next window when this few of its songs are left
+PLAYLIST_LOW_WATER = 10
+# seconds before the current song ends that the next one's source is started
+PREWARM_SECONDS = 5
+# seconds without a new frame before a playing stream counts as stalled
+STALL_SECONDS = 10
+# seconds between checks of the playing stream
+STALL_CHECK_INTERVAL = 1
+# seconds short of the song's duration a stream may end without being resumed
+EARLY_END_SLACK = 5
+# times a song is resumed before it's let go
+RECOVERY_ATTEMPTS = 3
+# seconds the bot stays in a voice channel with nothing to play
+IDLE_TIMEOUT = 600
+# attempts at loading a song before it gets skipped
+LOAD_ATTEMPTS = 2
+# songs failing in a row before the player gives up on the queue
+MAX_FAILURES = 5
+
+# player events
+TRACK_ENDED = 'track_ended'
+ENQUEUE = 'enqueue'
+SKIP = 'skip'
+SEEK = 'seek'
+STOP = 'stop'
+
+
+def open_source(
+    song: Song,
+    volume: float,
+    start: float | None = None,
+    frames: int = PREBUFFER_FRAMES,
+    priority: int = PRIORITY_LIVE,
+    slot: ProcessSlot | None = None
+) -> discord.AudioSource:
+    """Create a song's source and read its first frames. Blocks, run it in the resolver."""
+    source = song.extract_source(volume, start, priority, slot)
+    if stream := buffered(source):
+        try:
+            stream.fill(frames)
+        except Exception:
+            source.cleanup()
+            raise
+    return source
+
+
+async def prepare_source(
+    song: Song,
+    volume: float,
+    start: float | None = None,
+    frames: int = PREBUFFER_FRAMES,
+    priority: int = PRIORITY_LIVE,
+    guild_id: int | None = None,
+    lane: int = LANE_INTERACTIVE,
+    timeout: float | None = PROCESS_WAIT
+) -> discord.AudioSource:
+    """Open a song's source in the resolver, see :func:`open_source`.
+
+    Its process slot is waited for on the event loop first, a job waiting for
+    one would hold a resolver worker that other servers' lookups need. Raises
+    :class:`BudgetTimeout` if none is freed within timeout."""
+    slot = await process_budget.wait(priority, timeout)
+    # decides whether the job or the caller gives the slot back
+    lock = threading.Lock()
+    claimed = False
+
+    def job() -> discord.AudioSource:
+        nonlocal claimed
+        with lock:
+            if slot.released:
+                raise Exception('The source was no longer needed.')
+            claimed = True
+        return open_source(song, volume, start, frames, priority, slot)
+
+    try:
+        # a source finished after the caller was cancelled is cleaned up
+        return await run_in_resolver(job, guild_id=guild_id, lane=lane, discard=lambda source: source.cleanup())
+    except BaseException:
+        with lock:
+            if not claimed:
+                slot.release()
+        raise
+
+
+class Prefetcher:
+    """Resolves the songs at the head of a server's queue in the background.
+
+    Attributes
+    -----------
+    server_music: :class:`ServerMusic`
+        The server whose queue is prefetched.
+    depth: :class:`int`
+        How many songs from the head of the queue to resolve.
+    task: :class:`asyncio.Task`
+        The running prefetch, if any.
+    """
+
+    def __init__(self, server_music: ServerMusic, depth: int = PREFETCH_DEPTH):
+        self.server_music = server_music
+        self.depth = depth
+        self.task: asyncio.Task | None = None
+
+    def retarget(self):
+        """Restart prefetching for the current head of the queue.
+
+        Has to be called from the event loop."""
+        self.cancel()
+        if self.server_music.queue:
+            self.task = asyncio.create_task(self.run())
+
+    def cancel(self):
+        if self.task and not self.task.done():
+            self.task.cancel()
+        self.task = None
+
+    async def run(self):
+        for song in self.server_music.queue[:self.depth]:
+            if song.is_resolved:
+                continue
+            try:
+                await run_in_resolver(
+                    song.extract_url,
+                    guild_id=self.server_music.guild_id,
+                    lane=LANE_BACKGROUND
+                )
+            except Exception as e:
+                print(e)
+
+
+class Prewarmer:
+    """Starts the next song's source shortly before the current one ends.
+
+    Its ffmpeg process gets to connect and buffer the first frames, so the next
+    song can start right away. The source is dropped if the head of the queue
+    changes in the meantime.
+
+    Attributes
+    -----------
+    server_music: :class:`ServerMusic`
+        The server whose next song is prewarmed.
+    lead: :class:`float`
+        Seconds before the end of the current song to start the next one.
+    song: :class:`Song`
+        The song being prewarmed.
+    volume: :class:`float`
+        The volume the source was made with.
+    source: :class:`discord.AudioSource`
+        The ready source.
+    task: :class:`asyncio.Task`
+        The latest warm, only its source is kept.
+    """
+
+    def __init__(self, server_music: ServerMusic, lead: float = PREWARM_SECONDS):
+        self.server_music = server_music
+        self.lead = lead
+        self.timer: asyncio.TimerHandle | None = None
+        self.task: asyncio.Task | None = None
+        self.song: Song | None = None
+        self.volume = 1.
+        self.source: discord.AudioSource | None = None
+
+    def schedule(self, remaining: float, volume: float):
+        """Prewarm the head of the queue once remaining seconds are almost over.
+
+        Has to be called from the event loop."""
+        self.cancel_timer()
+        loop = asyncio.get_running_loop()
+        self.timer = loop.call_later(max(0., remaining - self.lead), self.start, volume)
+
+    def cancel_timer(self):
+        if self.timer:
+            self.timer.cancel()
+            self.timer = None
+
+    def start(self, volume: float):
+        self.timer = None
+        queue = self.server_music.queue
+        if not queue:
+            return
+        song = queue[0]
+        # seeks come with their source already
+        if song is self.song or song.source:
+            return
+        self.discard()
+        self.song = song
+        self.volume = volume
+        self.task = asyncio.create_task(self.warm(song, volume))
+
+    async def warm(self, song: Song, volume: float):
+        try:
+            source = await prepare_source(
+                song, volume,
+                priority=PRIORITY_PREFETCH,
+                guild_id=self.server_music.guild_id,
+                lane=LANE_BACKGROUND
+            )
+        except Exception as e:
+            print(e)
+            if self.is_current(song):
+                self.song = None
+            return
+        # an earlier warm of the same song object may finish after a later one started
+        if self.is_current(song):
+            self.source = source
+        else:
+            source.cleanup()
+
+    def is_current(self, song: Song) -> bool:
+        return self.song is song and self.task is asyncio.current_task()
+
+    async def take(self, song: Song, volume: float) -> discord.AudioSource | None:
+        """The prewarmed source if it's for this song, anything else is dropped."""
+        self.cancel_timer()
+        if self.song is song and self.volume == volume:
+            if self.task and not self.task.done():
+                await asyncio.shield(self.task)
+            if self.source:
+                source, self.source, self.song = self.source, None, None
+                return source
+        self.discard()
+        return None
+
+    def retarget(self):
+        """Drop the prewarmed source if its song isn't next anymore."""
+        queue = self.server_music.queue
+        if self.song and (not queue or queue[0] is not self.song):
+            self.discard()
+
+    def discard(self):
+        """Forget the prewarmed song, a source that is still opening is cleaned up by its task."""
+        self.song = None
+        self.task = None
+        if self.source:
+            self.source.cleanup()
+            self.source = None
+
+
+class Supervisor:
+    """Watches the playing stream and resumes it where it broke off.
+
+    Stream urls expire, and ffmpeg's reconnects give up on them sooner or
+    later, which shows up as a stream that stops sending frames or ends before
+    the song does. A stalled stream is cleaned up so it ends, and a song that
+    ended early is reopened from a fresh url at the position it got to. A
+    listener that fell behind a shared stream is reopened from the same url.
+
+    Attributes
+    -----------
+    server_music: :class:`ServerMusic`
+        The server whose playing stream is watched.
+    task: :class:`asyncio.Task`
+        The running watch, if any.
+    stalled: :class:`bool`
+        Whether the watched stream was cleaned up for stalling.
+    """
+
+    def __init__(self, server_music: ServerMusic):
+        self.server_music = server_music
+        self.task: asyncio.Task | None = None
+        self.stalled = False
+
+    def watch(self, stream: BufferedSource):
+        """Start watching a stream that just started playing.
+
+        Has to be called from the event loop."""
+        self.cancel()
+        self.stalled = False
+        self.task = asyncio.create_task(self.run(stream))
+
+    def cancel(self):
+        if self.task and not self.task.done():
+            self.task.cancel()
+        self.task = None
+
+    async def run(self, stream: BufferedSource):
+        last = time.monotonic()
+        while stream.ended_at is None:
+            await asyncio.sleep(STALL_CHECK_INTERVAL)
+            vc = self.server_music.vc
+            now = time.monotonic()
+            # a paused player doesn't read, which isn't a stall
+            if not vc or not vc.is_playing():
+                last = now
+                continue
+            if stream.read_at and stream.read_at > last:
+                last = stream.read_at
+            if now - last > STALL_SECONDS:
+                metrics.incr('player.stalls')
+                self.stalled = True
+                # kills ffmpeg, so the player gets an early end
+                stream.cleanup()
+                return
+
+    async def recover(self, song: Song, stream: BufferedSource, volume: float) -> discord.AudioSource | None:
+        """A new source for a song whose stream ended early, starting where it stopped.
+
+        Returns ``None`` if the song did play to its end, or can't be resumed."""
+        position = stream.position
+        length = song.expected_length
+        if length and position >= length - EARLY_END_SLACK:
+            return None
+        # without a length only a stall or falling behind tells it broke off
+        if not (length or self.stalled or stream.fell_behind):
+            return None
+        metrics.incr('player.fell_behind' if stream.fell_behind else 'player.early_ends')
+        playback = song.playback
+        if playback.recoveries >= RECOVERY_ATTEMPTS:
+            metrics.incr('player.failed_recoveries')
+            return None
+        playback.recoveries += 1
+        # the url most likely expired, a local copy or a shared stream's url is still good
+        if not stream.fell_behind and not song.is_local:
+            song.invalidate()
+        try:
+            # the song is silent until this is done
+            source = await self.reopen(song, volume, position)
+        except Exception as e:
+            print(e)
+            # a full budget says nothing about the local copy
+            if not song.is_local or isinstance(e, BudgetTimeout):
+                metrics.incr('player.failed_recoveries')
+                return None
+            # the local copy is broken, play on from youtube
+            song.invalidate()
+            try:
+                source = await self.reopen(song, volume, position)
+            except Exception as e:
+                print(e)
+                metrics.incr('player.failed_recoveries')
+                return None
+        song.set_progress(position)
+        metrics.incr('player.recoveries')
+        metrics.observe('player.recovery', time.monotonic() - (stream.ended_at or time.monotonic()))
+        return source
+
+    async def reopen(self, song: Song, volume: float, position: float) -> discord.AudioSource:
+        return await prepare_source(song, volume, position, 1, guild_id=self.server_music.guild_id)
+
+
+class IdleScheduler:
+    """Runs a callback for servers that stayed idle for too long.
+
+    The timers live in the event loop's timer heap, so idle servers don't hold
+    a thread while they wait.
+
+    Attributes
+    -----------
+    timeout: :class:`float`
+        Seconds of idling before the callback runs.
+    handles: Dict[:class:`int`,:class:`asyncio.TimerHandle`]
+        The pending timer of each server.
+    """
+
+    def __init__(self, timeout: float = IDLE_TIMEOUT):
+        self.timeout = timeout
+        self.handles: dict[int, asyncio.TimerHandle] = {}
+
+    def schedule(self, guild_id: int, callback: Callable[[], Awaitable]):
+        """Start the idle timer of a server, replacing any pending one.
+
+        Has to be called from the event loop."""
+        self.cancel(guild_id)
+        loop = asyncio.get_running_loop()
+        self.handles[guild_id] = loop.call_later(
+            self.timeout,
+            self.fire,
+            guild_id,
+            callback
+        )
+
+    def fire(self, guild_id: int, callback: Callable[[], Awaitable]):
+        self.handles.pop(guild_id, None)
+        asyncio.create_task(callback())
+
+    def cancel(self, guild_id: int):
+        handle = self.handles.pop(guild_id, None)
+        if handle:
+            handle.cancel()
+
+    def cancel_all(self):
+        for handle in self.handles.values():
+            handle.cancel()
+        self.handles.clear()
@@ -0,0 +1,202 @@
+import numpy as np
+from typing import Iterable, Iterator
+from .diskqueue import DiskQueue
+from .songqueue import SongQueue, duration_of
+
+# upcoming songs of a shuffled disk backed queue kept in memory, so the
+# prefetcher, the prewarmer and the player all get the same song objects
+PINNED_SONGS = 10
+
+
+class PlayOrder:
+    """Shuffled view over a queue that leaves the songs in their original order.
+
+    Positions are in play order, ``order[pos]`` is the position of that song in
+    the underlying queue. Songs added while shuffled keep their place relative
+    to their neighbours in the original order too, so dropping the view gives
+    back the unshuffled queue at any time.
+
+    Attributes
+    -----------
+    base: :class:`SongQueue`
+        The queue in its original order.
+    order: :class:`numpy.ndarray`
+        The play order as indices into the base queue.
+    lengths: :class:`numpy.ndarray`
+        The songs' durations in base order, for wait times.
+    pinned: Dict[:class:`int`,:class:`Song`]
+        Songs read from a disk backed base, by base index. Reading them again
+        would give a new copy each time.
+    """
+
+    def __init__(self, base: SongQueue | DiskQueue):
+        self.base = base
+        self.lengths = np.fromiter((duration_of(song) for song in base), dtype=np.float64, count=len(base))
+        self.order = np.random.permutation(len(base))
+        self.pinned: dict[int, object] | None = {} if isinstance(base, DiskQueue) else None
+
+    def __len__(self):
+        return len(self.order)
+
+    def __bool__(self):
+        return len(self.order) > 0
+
+    def __iter__(self) -> Iterator:
+        for index in self.order:
+            yield self.base[int(index)]
+
+    def __repr__(self):
+        return f'PlayOrder({self.base!r})'
+
+    def index_range(self, pos: int) -> int:
+        length = len(self)
+        if pos < 0:
+            pos += length
+        if not 0 <= pos < length:
+            raise IndexError('queue index out of range')
+        return pos
+
+    def song_at(self, pos: int):
+        """The song at a play position, pinned in memory if it's about to play."""
+        index = int(self.order[pos])
+        if self.pinned is None:
+            return self.base[index]
+        if (song := self.pinned.get(index)) is not None:
+            return song
+        song = self.base[index]
+        if pos < PINNED_SONGS:
+            if len(self.pinned) >= 2 * PINNED_SONGS:
+                upcoming = set(self.order[:PINNED_SONGS].tolist())
+                self.pinned = {i: s for i, s in self.pinned.items() if i in upcoming}
+            self.pinned[index] = song
+        return song
+
+    def shift_pins(self, indices: dict[int, int]):
+        """Move pinned songs to their new base indices, dropping those missing from indices."""
+        self.pinned = {indices[i]: song for i, song in self.pinned.items() if i in indices}
+
+    def base_pos(self, pos: int) -> int:
+        """Where songs inserted before this play position go in the base queue."""
+        if pos > 0:
+            return int(self.order[pos - 1]) + 1
+        return int(self.order[0]) if len(self) else 0
+
+    def insert_many(self, pos: int, songs: list):
+        if not songs:
+            return
+        at = self.base_pos(pos)
+        self.base[at:at] = songs
+        if self.pinned:
+            self.shift_pins({i: i + len(songs) if i >= at else i for i in self.pinned})
+        self.lengths = np.insert(self.lengths, at, [duration_of(song) for song in songs])
+        self.order[self.order >= at] += len(songs)
+        self.order = np.insert(self.order, pos, np.arange(at, at + len(songs)))
+
+    def delete_many(self, positions: np.ndarray):
+        if not len(positions):
+            return
+        removed = np.sort(self.order[positions])
+        for index in removed[::-1]:
+            del self.base[int(index)]
+        if self.pinned:
+            gone = set(removed.tolist())
+            self.shift_pins({
+                i: i - int(np.searchsorted(removed, i)) for i in self.pinned if i not in gone
+            })
+        self.lengths = np.delete(self.lengths, removed)
+        order = np.delete(self.order, positions)
+        self.order = order - np.searchsorted(removed, order)
+
+    def __getitem__(self, pos: int | slice):
+        if isinstance(pos, slice):
+            return [self.song_at(i) for i in range(len(self))[pos]]
+        return self.song_at(self.index_range(pos))
+
+    def __setitem__(self, pos: int | slice, value):
+        if isinstance(pos, slice):
+            start, stop, step = pos.indices(len(self))
+            if step != 1:
+                raise ValueError('queue slices can\'t have a step')
+            del self[start:stop]
+            self.insert_many(start, list(value))
+            return
+        index = int(self.order[self.index_range(pos)])
+        self.base[index] = value
+        self.lengths[index] = duration_of(value)
+        if self.pinned is not None:
+            self.pinned[index] = value
+
+    def __delitem__(self, pos: int | slice):
+        if isinstance(pos, slice):
+            self.delete_many(np.arange(len(self))[pos])
+            return
+        self.pop(pos)
+
+    def __iadd__(self, songs: Iterable):
+        self.extend(songs)
+        return self
+
+    def append(self, song):
+        self.extend((song,))
+
+    def extend(self, songs: Iterable):
+        songs = list(songs)
+        length = len(self.base)
+        self.base.extend(songs)
+        self.lengths = np.append(self.lengths, [duration_of(song) for song in songs])
+        self.order = np.append(self.order, np.arange(length, length + len(songs)))
+
+    def insert(self, pos: int, song):
+        length = len(self)
+        if pos < 0:
+            pos = max(0, pos + length)
+        self.insert_many(min(pos, length), [song])
+
+    def pop(self, pos: int = -1):
+        pos = self.index_range(pos)
+        song = self[pos]
+        self.delete_many(np.array([pos]))
+        return song
+
+    def find(self, song) -> int:
+        if self.pinned:
+            index = next((i for i, pinned in self.pinned.items() if pinned is song), None)
+            if index is not None:
+                return int(np.flatnonzero(self.order == index)[0])
+        index = self.base.find(song)
+        if index == -1:
+            return -1
+        return int(np.flatnonzero(self.order == index)[0])
+
+    def clear(self):
+        self.base.clear()
+        if self.pinned is not None:
+            self.pinned.clear()
+        self.lengths = np.empty(0, dtype=np.float64)
+        self.order = np.empty(0, dtype=np.int64)
+
+    def reverse(self):
+        self.order = self.order[::-1].copy()
+
+    def shuffle(self):
+        np.random.shuffle(self.order)
+
+    def move(self, _from: int, _to: int):
+        _from = self.index_range(_from)
+        index = self.order[_from]
+        order = np.delete(self.order, _from)
+        if _to < 0:
+            _to = max(0, _to + len(order))
+        self.order = np.insert(order, min(_to, len(order)), index)
+
+    def swap(self, pos1: int, pos2: int):
+        pos1, pos2 = self.index_range(pos1), self.index_range(pos2)
+        self.order[[pos1, pos2]] = self.order[[pos2, pos1]]
+
+    def wait_time(self, pos: int) -> float:
+        """Total duration of the songs before a play position, in seconds."""
+        return float(self.lengths[self.order[:max(0, pos)]].sum())
+
+    @property
+    def duration(self) -> float:
+        return self.base.duration
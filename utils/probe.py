@@ -0,0 +1,110 @@
+import asyncio
+import json
+import re
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from .processes import PRIORITY_PROBE, process_budget
+
+# seconds ffprobe gets before it's killed
+PROBE_TIMEOUT = 15
+# how many probe results are remembered
+PROBE_CACHE_SIZE = 1024
+
+ATTACHMENT_PATTERN = re.compile(r'/attachments/\d+/(\d+)/')
+
+
+@dataclass
+class Probe:
+    """What ffprobe found out about a media url.
+
+    Attributes
+    -----------
+    duration: :class:`float`
+        The length in seconds.
+    codec: :class:`str`
+        The audio codec, eg. opus, mp3.
+    bitrate: :class:`int`
+        Bits per second of the audio stream, or the whole file if unknown.
+    channels: :class:`int`
+        The amount of audio channels.
+    """
+    duration: float
+    codec: str | None = None
+    bitrate: int | None = None
+    channels: int | None = None
+
+
+def probe_key(url: str) -> str:
+    """Discord attachment urls get re-signed, so they're keyed by attachment id."""
+    match = ATTACHMENT_PATTERN.search(url)
+    return f'attachment:{match.group(1)}' if match else url
+
+
+class ProbeCache:
+    def __init__(self, maxsize: int = PROBE_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.entries: OrderedDict[str, Probe] = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, url: str) -> Probe | None:
+        key = probe_key(url)
+        with self.lock:
+            probe = self.entries.get(key)
+            if probe:
+                self.entries.move_to_end(key)
+            return probe
+
+    def put(self, url: str, probe: Probe):
+        key = probe_key(url)
+        with self.lock:
+            self.entries[key] = probe
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+
+probe_cache = ProbeCache()
+
+
+def parse_probe(output: bytes) -> Probe:
+    data = json.loads(output)
+    fmt = data.get('format', {})
+    streams = data.get('streams') or [{}]
+    stream = streams[0]
+    duration = stream.get('duration') or fmt.get('duration')
+    bitrate = stream.get('bit_rate') or fmt.get('bit_rate')
+    return Probe(
+        duration=float(duration),
+        codec=stream.get('codec_name'),
+        bitrate=int(bitrate) if bitrate else None,
+        channels=stream.get('channels')
+    )
+
+
+async def probe(url: str, timeout: float = PROBE_TIMEOUT) -> Probe:
+    """Probe a url with ffprobe, without a shell and with a hard timeout."""
+    if cached := probe_cache.get(url):
+        return cached
+    with await process_budget.wait(PRIORITY_PROBE):
+        process = await asyncio.create_subprocess_exec(
+            'ffprobe', '-v', 'quiet',
+            '-print_format', 'json',
+            '-show_format', '-show_streams',
+            '-select_streams', 'a:0',
+            '-i', url,
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL
+        )
+        try:
+            output, _ = await asyncio.wait_for(process.communicate(), timeout)
+        except asyncio.TimeoutError:
+            process.kill()
+            await process.wait()
+            raise
+    if process.returncode != 0:
+        raise Exception(f'ffprobe exited with {process.returncode}.')
+    result = parse_probe(output)
+    probe_cache.put(url, result)
+    return result
@@ -0,0 +1,209 @@
+import asyncio
+import heapq
+import itertools
+import os
+import threading
+import time
+import discord
+from collections import Counter
+from typing import Callable
+from .metrics import metrics
+
+# ffmpeg and ffprobe processes running at once, unless FFMPEG_MAX_PROCESSES says otherwise,
+# a playing server holds one for the whole song unless it shares a stream, so
+# this is sized for a few hundred servers playing at once
+MAX_PROCESSES = 320
+# seconds a spawn waits for a free slot before it fails
+PROCESS_WAIT = 30
+
+# priority classes, lower ones go first
+PRIORITY_LIVE = 0
+PRIORITY_PREFETCH = 1
+PRIORITY_PROBE = 2
+# share of the limit each class can fill, the rest is kept for the classes above it
+PRIORITY_SHARES = {
+    PRIORITY_LIVE: 1.,
+    PRIORITY_PREFETCH: .75,
+    PRIORITY_PROBE: .5,
+}
+PRIORITY_NAMES = {
+    PRIORITY_LIVE: 'live',
+    PRIORITY_PREFETCH: 'prefetch',
+    PRIORITY_PROBE: 'probe',
+}
+
+
+def process_limit() -> int:
+    return int(os.getenv('FFMPEG_MAX_PROCESSES', MAX_PROCESSES))
+
+
+class BudgetTimeout(Exception):
+    """No process slot was freed in time, nothing is wrong with what was being opened."""
+
+    def __init__(self):
+        super().__init__('Too many ffmpeg processes are running, try again later.')
+
+
+class Waiter:
+    __slots__ = ('priority', 'notify', 'granted', 'cancelled')
+
+    def __init__(self, priority: int, notify: Callable[[], None]):
+        self.priority = priority
+        self.notify = notify
+        self.granted = False
+        self.cancelled = False
+
+
+class ProcessSlot:
+    """The right to run one process, released when the process is done with.
+
+    Can be used as a context manager around short lived processes.
+    """
+
+    def __init__(self, budget: 'ProcessBudget', priority: int):
+        self.budget = budget
+        self.priority = priority
+        self.released = False
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self.budget.release(self.priority)
+
+    def __enter__(self) -> 'ProcessSlot':
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class ProcessBudget:
+    """Limits the ffmpeg and ffprobe processes the bot runs at once.
+
+    Every spawn takes a slot first. When none is free it queues, and freed
+    slots go to the waiting spawn of the highest priority class, first come
+    first served within a class. Lower classes can only fill a share of the
+    limit, so a burst of probes can't keep songs from starting.
+
+    Attributes
+    -----------
+    running: Counter[:class:`int`]
+        Running processes of each priority class.
+    waiters: List[:class:`Waiter`]
+        Heap of the queued spawns.
+    """
+
+    def __init__(self):
+        self.running: Counter[int] = Counter()
+        self.waiters: list[tuple[int, int, Waiter]] = []
+        self.order = itertools.count()
+        self.lock = threading.Lock()
+
+    @property
+    def total(self) -> int:
+        return sum(self.running.values())
+
+    @property
+    def waiting(self) -> int:
+        return sum(not waiter.cancelled for _, _, waiter in self.waiters)
+
+    def allows(self, priority: int) -> bool:
+        return self.total < max(1, int(process_limit() * PRIORITY_SHARES[priority]))
+
+    def first_waiter(self) -> Waiter | None:
+        """Needs the lock."""
+        while self.waiters and self.waiters[0][2].cancelled:
+            heapq.heappop(self.waiters)
+        return self.waiters[0][2] if self.waiters else None
+
+    def enter(self, priority: int, notify: Callable[[], None]) -> Waiter:
+        """Take a slot now, or queue for one and get notified when it's granted."""
+        waiter = Waiter(priority, notify)
+        with self.lock:
+            first = self.first_waiter()
+            if self.allows(priority) and (first is None or first.priority > priority):
+                self.running[priority] += 1
+                waiter.granted = True
+                return waiter
+            heapq.heappush(self.waiters, (priority, next(self.order), waiter))
+        metrics.incr('processes.queued')
+        return waiter
+
+    def cancel(self, waiter: Waiter):
+        """Stop waiting, giving the slot back if it was granted meanwhile."""
+        with self.lock:
+            waiter.cancelled = True
+            granted = waiter.granted
+        if granted:
+            self.release(waiter.priority)
+
+    def release(self, priority: int):
+        granted = []
+        with self.lock:
+            self.running[priority] -= 1
+            while (first := self.first_waiter()) and self.allows(first.priority):
+                heapq.heappop(self.waiters)
+                self.running[first.priority] += 1
+                first.granted = True
+                granted.append(first)
+        for waiter in granted:
+            waiter.notify()
+
+    def acquire(self, priority: int, timeout: float | None = PROCESS_WAIT) -> ProcessSlot:
+        """Wait for a slot, blocking. Raises if none is free within timeout."""
+        event = threading.Event()
+        started = time.monotonic()
+        waiter = self.enter(priority, event.set)
+        if not waiter.granted and not event.wait(timeout):
+            self.cancel(waiter)
+            metrics.incr('processes.timeouts')
+            raise BudgetTimeout()
+        metrics.observe(f'processes.wait.{PRIORITY_NAMES[priority]}', time.monotonic() - started)
+        return ProcessSlot(self, priority)
+
+    async def wait(self, priority: int, timeout: float | None = PROCESS_WAIT) -> ProcessSlot:
+        """Wait for a slot without blocking the event loop."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def notify():
+            loop.call_soon_threadsafe(lambda: future.done() or future.set_result(None))
+
+        started = time.monotonic()
+        waiter = self.enter(priority, notify)
+        if not waiter.granted:
+            try:
+                await asyncio.wait_for(future, timeout)
+            except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+                self.cancel(waiter)
+                if isinstance(e, asyncio.CancelledError):
+                    raise
+                metrics.incr('processes.timeouts')
+                raise BudgetTimeout()
+        metrics.observe(f'processes.wait.{PRIORITY_NAMES[priority]}', time.monotonic() - started)
+        return ProcessSlot(self, priority)
+
+    def report(self) -> str:
+        running = ', '.join(f'{PRIORITY_NAMES[priority]} {count}' for priority, count in sorted(self.running.items()) if count)
+        return f'ffmpeg processes: {self.total}/{process_limit()} ({running or "none"}), waiting {self.waiting}'
+
+
+class BudgetedSource(discord.AudioSource):
+    """An ffmpeg source that gives its process slot back once it's cleaned up."""
+
+    def __init__(self, original: discord.AudioSource, slot: ProcessSlot):
+        self.original = original
+        self.slot = slot
+
+    def read(self) -> bytes:
+        return self.original.read()
+
+    def is_opus(self) -> bool:
+        return self.original.is_opus()
+
+    def cleanup(self):
+        self.original.cleanup()
+        self.slot.release()
+
+
+process_budget = ProcessBudget()
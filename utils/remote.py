@@ -0,0 +1,313 @@
+import json
+import os
+import secrets
+import threading
+import time
+import urllib.error
+import urllib.request
+import aiohttp
+from aiohttp import web
+from collections import OrderedDict
+from typing import AsyncIterator, Literal
+from .cache import stream_cache, video_id
+from .matcher import forget_match, match_spotify
+from .metrics import metrics
+from .music import Playlist, Song, Time
+from .scheduler import LANE_BACKGROUND, LANE_INTERACTIVE, current_lookup
+
+# port the resolver service listens on by default
+RESOLVER_PORT = 8765
+# seconds a call to the resolver service may take
+REMOTE_TIMEOUT = 120
+# lazily extracted playlists the service keeps open for the bots
+MAX_CURSORS = 256
+# youtube lookups the bots can ask the service for directly
+YOUTUBE_METHODS = ('from_query_multiple', 'from_url')
+
+_remote = None
+
+
+def remote_resolver() -> 'RemoteResolver | None':
+    """The resolver service set by RESOLVER_URL, or None to resolve in this process."""
+    global _remote
+    url = os.getenv('RESOLVER_URL')
+    if not url:
+        return None
+    if _remote is None or _remote.url != url.rstrip('/'):
+        _remote = RemoteResolver(url)
+    return _remote
+
+
+def update_playlist(playlist: Playlist, record: list):
+    """Bring a playlist up to date with its record from the service."""
+    playlist.duration = Time(record[3])
+    playlist.track_num = record[4]
+    playlist.loaded = record[5]
+
+
+def from_result(result: list | bool) -> list[Song] | Song | Literal[False]:
+    if not result:
+        return False
+    if isinstance(result[0], list):
+        return [Song.from_record(record) for record in result]
+    return Song.from_record(result)
+
+
+class RemoteCursor:
+    """A youtube playlist extracted window by window in the resolver service.
+
+    Stands in for :class:`PlaylistCursor` in the bot process.
+
+    Attributes
+    -----------
+    resolver: :class:`RemoteResolver`
+        The service the cursor lives in.
+    id: :class:`str`
+        The cursor's id in the service.
+    playlist: :class:`Playlist`
+        The playlist, its length and duration grow as windows are extracted.
+    last: :class:`Song`
+        The last extracted song, the next window is queued after it.
+    message: :class:`discord.Message`
+        The playlist embed to keep up to date.
+    done: :class:`bool`
+        Whether the whole playlist was extracted.
+    """
+
+    def __init__(self, resolver: 'RemoteResolver', cursor_id: str, playlist: Playlist):
+        self.resolver = resolver
+        self.id = cursor_id
+        self.playlist = playlist
+        self.playlist.pending = self
+        self.last: Song | None = None
+        self.message = None
+        self.done = False
+        self.lock = threading.Lock()
+
+    def next_window(self) -> list[Song]:
+        with self.lock:
+            data = self.resolver.call('next_window', {'cursor': self.id})
+            songs = [Song.from_record(record) for record in data['songs']]
+            update_playlist(self.playlist, data['playlist'])
+            if data['done']:
+                self.done = True
+                self.playlist.pending = None
+            if songs:
+                self.last = songs[-1]
+            return songs
+
+
+class RemoteResolver:
+    """Client of the resolver service, see :func:`resolver_app`.
+
+    yt-dlp is pure python and CPU heavy, so in the bot process it competes for
+    the GIL with the voice threads. The service does the lookups and keeps the
+    caches for every bot process using it, the bots only send queries and get
+    song records back.
+
+    Attributes
+    -----------
+    url: :class:`str`
+        Where the service listens, eg. http://127.0.0.1:8765.
+    """
+
+    def __init__(self, url: str):
+        self.url = url.rstrip('/')
+        self.session: aiohttp.ClientSession | None = None
+
+    def get_session(self) -> aiohttp.ClientSession:
+        if self.session is None or self.session.closed:
+            self.session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=REMOTE_TIMEOUT))
+        return self.session
+
+    async def close(self):
+        if self.session and not self.session.closed:
+            await self.session.close()
+        self.session = None
+
+    def call(self, op: str, payload: dict) -> dict:
+        """Blocking call, made from the resolver threads."""
+        guild, lane = current_lookup()
+        request = urllib.request.Request(
+            f'{self.url}/{op}',
+            data=json.dumps({**payload, 'guild_id': guild, 'lane': lane}).encode(),
+            headers={'Content-Type': 'application/json'}
+        )
+        started = time.monotonic()
+        try:
+            with urllib.request.urlopen(request, timeout=REMOTE_TIMEOUT) as response:
+                data = json.loads(response.read())
+        except urllib.error.HTTPError as e:
+            metrics.incr('remote.errors')
+            raise Exception(json.loads(e.read()).get('error') or str(e))
+        except urllib.error.URLError as e:
+            metrics.incr('remote.errors')
+            raise Exception(f'The resolver service is unreachable: {e.reason}')
+        metrics.observe(f'remote.{op}', time.monotonic() - started)
+        return data
+
+    def match(self, song: Song) -> str:
+        return self.call('match', {'song': song.to_record()})['yturl']
+
+    def forget_match(self, song: Song):
+        self.call('forget_match', {'song': song.to_record()})
+
+    def stream(self, yturl: str, refresh: bool = False) -> tuple[str | None, float | None]:
+        """The stream url and duration of a video, refresh skips the service's cache."""
+        data = self.call('stream', {'yturl': yturl, 'refresh': refresh})
+        return data['url'], data['length']
+
+    def youtube(self, method: str, *args) -> list[Song] | Song | Literal[False]:
+        return from_result(self.call('youtube', {'method': method, 'args': args})['result'])
+
+    async def pages(self, query: str, guild_id: int | None = None) -> AsyncIterator[tuple[list[Song], Playlist | Literal[False]]]:
+        """Resolve a query like :func:`resolve_pages`, pages arrive as the service finds them."""
+        started = time.monotonic()
+        playlist: Playlist | Literal[False] = False
+        async with self.get_session().post(
+            f'{self.url}/pages',
+            json={'query': query, 'guild_id': guild_id}
+        ) as response:
+            async for line in response.content:
+                data = json.loads(line)
+                if 'error' in data:
+                    metrics.incr('remote.errors')
+                    raise Exception(data['error'])
+                songs = [Song.from_record(record) for record in data['songs']]
+                if data['playlist'] and playlist:
+                    update_playlist(playlist, data['playlist'])
+                elif data['playlist']:
+                    playlist = Playlist.from_record(data['playlist'])
+                if data['cursor'] and playlist and not playlist.pending:
+                    cursor = RemoteCursor(self, data['cursor'], playlist)
+                    cursor.last = songs[-1] if songs else None
+                metrics.observe('remote.pages', time.monotonic() - started)
+                yield songs, playlist
+
+
+class CursorTable:
+    """The lazy playlists the service is extracting, least recently used dropped first."""
+
+    def __init__(self, maxsize: int = MAX_CURSORS):
+        self.maxsize = maxsize
+        self.cursors: OrderedDict[str, 'PlaylistCursor'] = OrderedDict()
+
+    def add(self, cursor: 'PlaylistCursor') -> str:
+        cursor_id = secrets.token_hex(8)
+        self.cursors[cursor_id] = cursor
+        while len(self.cursors) > self.maxsize:
+            self.cursors.popitem(last=False)
+        return cursor_id
+
+    def get(self, cursor_id: str) -> 'PlaylistCursor | None':
+        cursor = self.cursors.get(cursor_id)
+        if cursor:
+            self.cursors.move_to_end(cursor_id)
+        return cursor
+
+    def pop(self, cursor_id: str):
+        self.cursors.pop(cursor_id, None)
+
+
+def resolver_app() -> web.Application:
+    """The resolver service, run it with ``python resolver_service.py``.
+
+    Every call is a json POST. Lookups go through the service's own resolver
+    scheduler with the server and lane the bot sent, so servers of all bot
+    processes are scheduled fairly against each other. Failed lookups answer
+    with status 400 and their error message.
+    """
+    from .search import Youtube, extract_stream, resolve_pages, run_in_resolver
+    cursors = CursorTable()
+
+    def lookup(body: dict, func, *args):
+        return run_in_resolver(func, *args, guild_id=body.get('guild_id'), lane=body.get('lane', LANE_INTERACTIVE))
+
+    async def match(body: dict) -> dict:
+        return {'yturl': await lookup(body, match_spotify, Song.from_record(body['song']))}
+
+    async def forget(body: dict) -> dict:
+        forget_match(Song.from_record(body['song']))
+        return {}
+
+    async def stream(body: dict) -> dict:
+        key = video_id(body['yturl'])
+        if body.get('refresh'):
+            # the bot found the cached url broken
+            stream_cache.pop(key)
+            metrics.incr('remote.stream_refreshes')
+        elif url := stream_cache.get(key):
+            metrics.incr('remote.stream_hits')
+            return {'url': url, 'length': None}
+        url, length = await lookup(body, extract_stream, body['yturl'])
+        stream_cache.put(key, url)
+        return {'url': url, 'length': length}
+
+    async def youtube(body: dict) -> dict:
+        if body['method'] not in YOUTUBE_METHODS:
+            raise Exception(f'Unknown lookup {body["method"]}.')
+        result = await lookup(body, getattr(Youtube(), body['method']), *body['args'])
+        if isinstance(result, list):
+            return {'result': [song.to_record() for song in result]}
+        return {'result': result.to_record() if result else False}
+
+    async def next_window(body: dict) -> dict:
+        cursor = cursors.get(body['cursor'])
+        if cursor is None:
+            raise Exception('The playlist is no longer being extracted.')
+        songs = await run_in_resolver(cursor.next_window, guild_id=body.get('guild_id'), lane=LANE_BACKGROUND)
+        if cursor.done:
+            cursors.pop(body['cursor'])
+        return {
+            'songs': [song.to_record() for song in songs],
+            'playlist': cursor.playlist.to_record(),
+            'done': cursor.done
+        }
+
+    def handler(call):
+        async def handle(request: web.Request) -> web.Response:
+            started = time.monotonic()
+            try:
+                data = await call(await request.json())
+            except Exception as e:
+                metrics.incr('remote.errors')
+                return web.json_response({'error': str(e)}, status=400)
+            metrics.observe(f'remote.{call.__name__}', time.monotonic() - started)
+            return web.json_response(data)
+        return handle
+
+    async def pages(request: web.Request) -> web.StreamResponse:
+        body = await request.json()
+        response = web.StreamResponse(headers={'Content-Type': 'application/x-ndjson'})
+        await response.prepare(request)
+        cursor_id = None
+        try:
+            async for songs, playlist in resolve_pages(body['query'], body.get('guild_id')):
+                if playlist and playlist.pending and not cursor_id:
+                    cursor_id = cursors.add(playlist.pending)
+                line = {
+                    'songs': [song.to_record() for song in songs],
+                    'playlist': playlist.to_record() if playlist else False,
+                    'cursor': cursor_id
+                }
+                await response.write(json.dumps(line).encode() + b'\n')
+        except Exception as e:
+            metrics.incr('remote.errors')
+            await response.write(json.dumps({'error': str(e)}).encode() + b'\n')
+        await response.write_eof()
+        return response
+
+    async def stats(request: web.Request) -> web.Response:
+        return web.json_response({'metrics': metrics.report()})
+
+    app = web.Application()
+    app.add_routes([
+        web.post('/pages', pages),
+        web.post('/match', handler(match)),
+        web.post('/forget_match', handler(forget)),
+        web.post('/stream', handler(stream)),
+        web.post('/youtube', handler(youtube)),
+        web.post('/next_window', handler(next_window)),
+        web.get('/stats', stats),
+    ])
+    return app
@@ -0,0 +1,190 @@
+import asyncio
+import threading
+import time
+from collections import Counter, deque
+from concurrent.futures import Executor
+from typing import Callable, Hashable, TypeVar
+from .metrics import metrics
+
+# lanes, queued interactive lookups all go before background ones
+LANE_INTERACTIVE = 0
+LANE_BACKGROUND = 1
+LANE_NAMES = {
+    LANE_INTERACTIVE: 'interactive',
+    LANE_BACKGROUND: 'background',
+}
+# lookups of one server running at once in each lane
+GUILD_IN_FLIGHT = {
+    LANE_INTERACTIVE: 3,
+    LANE_BACKGROUND: 2,
+}
+# workers background lookups leave free, so interactive ones don't wait behind them
+INTERACTIVE_RESERVE = 1
+
+T = TypeVar('T')
+
+_running = threading.local()
+
+
+class Job:
+    __slots__ = ('func', 'guild', 'lane', 'future', 'discard', 'queued_at')
+
+    def __init__(
+        self,
+        func: Callable[[], T],
+        guild: Hashable,
+        lane: int,
+        future: asyncio.Future,
+        discard: Callable[[T], None] | None = None
+    ):
+        self.func = func
+        self.guild = guild
+        self.lane = lane
+        self.future = future
+        self.discard = discard
+        self.queued_at = time.monotonic()
+
+
+def current_lookup() -> tuple[Hashable, int]:
+    """The server and lane of the job running on this thread."""
+    return getattr(_running, 'guild', None), getattr(_running, 'lane', LANE_INTERACTIVE)
+
+
+def run_job(job: Job) -> T:
+    _running.guild, _running.lane = job.guild, job.lane
+    try:
+        return job.func()
+    finally:
+        _running.guild, _running.lane = None, LANE_INTERACTIVE
+
+
+class Lane:
+    """Queued jobs of one lane, taken out round robin over servers.
+
+    A server that queued thousands of lookups gets its turn as often as one
+    that queued a single lookup.
+
+    Attributes
+    -----------
+    jobs: Dict[Hashable,Deque[:class:`Job`]]
+        The queued jobs of each server.
+    ring: Deque[Hashable]
+        Servers with queued jobs, in turn order.
+    running: Counter[Hashable]
+        Running jobs of each server.
+    """
+
+    def __init__(self):
+        self.jobs: dict[Hashable, deque[Job]] = {}
+        self.ring: deque[Hashable] = deque()
+        self.running: Counter[Hashable] = Counter()
+
+    def __len__(self):
+        return sum(len(jobs) for jobs in self.jobs.values())
+
+    def push(self, job: Job):
+        if job.guild not in self.jobs:
+            self.jobs[job.guild] = deque()
+            self.ring.append(job.guild)
+        self.jobs[job.guild].append(job)
+
+    def pop(self, cap: int) -> Job | None:
+        """The next job, skipping servers with cap jobs running."""
+        for _ in range(len(self.ring)):
+            guild = self.ring[0]
+            self.ring.rotate(-1)
+            if self.running[guild] >= cap:
+                continue
+            jobs = self.jobs[guild]
+            job = jobs.popleft()
+            if not jobs:
+                del self.jobs[guild]
+                self.ring.pop()
+            return job
+        return None
+
+
+class ResolverScheduler:
+    """Shares the resolver workers fairly between servers.
+
+    Jobs are queued here instead of in the executor, and handed to it only
+    when a worker is free, so the order they run in can still be chosen:
+    interactive lookups first, round robin between servers within a lane, and
+    only a few running per server. Has to be used from the event loop.
+
+    Attributes
+    -----------
+    executor: :class:`concurrent.futures.Executor`
+        The pool running the jobs.
+    workers: :class:`int`
+        How many jobs it runs at once.
+    lanes: Dict[:class:`int`,:class:`Lane`]
+        The queued jobs of each lane.
+    running: :class:`int`
+        Jobs handed to the executor and not done yet.
+    """
+
+    def __init__(self, executor: Executor, workers: int):
+        self.executor = executor
+        self.workers = workers
+        self.lanes = {lane: Lane() for lane in LANE_NAMES}
+        self.running = 0
+
+    async def run(
+        self,
+        func: Callable[[], T],
+        guild: Hashable = None,
+        lane: int = LANE_INTERACTIVE,
+        discard: Callable[[T], None] | None = None
+    ) -> T:
+        """Run func in a worker, discard gets its result if the caller stopped waiting for it."""
+        loop = asyncio.get_running_loop()
+        job = Job(func, guild, lane, loop.create_future(), discard)
+        self.lanes[lane].push(job)
+        self.pump()
+        return await job.future
+
+    def pump(self):
+        while self.running < self.workers and (job := self.next_job()):
+            # the caller stopped waiting while it was queued
+            if job.future.cancelled():
+                continue
+            self.start(job)
+
+    def next_job(self) -> Job | None:
+        job = self.lanes[LANE_INTERACTIVE].pop(GUILD_IN_FLIGHT[LANE_INTERACTIVE])
+        if job is None and self.running < self.workers - INTERACTIVE_RESERVE:
+            job = self.lanes[LANE_BACKGROUND].pop(GUILD_IN_FLIGHT[LANE_BACKGROUND])
+        return job
+
+    def start(self, job: Job):
+        self.running += 1
+        self.lanes[job.lane].running[job.guild] += 1
+        metrics.observe(f'resolver.wait.{LANE_NAMES[job.lane]}', time.monotonic() - job.queued_at)
+        loop = asyncio.get_running_loop()
+        loop.run_in_executor(self.executor, run_job, job).add_done_callback(
+            lambda done: self.finish(job, done)
+        )
+
+    def finish(self, job: Job, done: asyncio.Future):
+        self.running -= 1
+        running = self.lanes[job.lane].running
+        running[job.guild] -= 1
+        if running[job.guild] <= 0:
+            del running[job.guild]
+        # the caller may have stopped waiting, the error is retrieved either way
+        if done.cancelled():
+            job.future.cancel()
+        elif error := done.exception():
+            if not job.future.done():
+                job.future.set_exception(error)
+        elif not job.future.done():
+            job.future.set_result(done.result())
+        elif job.discard:
+            # eg. a source nobody is going to play or clean up
+            job.discard(done.result())
+        self.pump()
+
+    def report(self) -> str:
+        queued = ', '.join(f'{name} {len(self.lanes[lane])}' for lane, name in LANE_NAMES.items())
+        return f'resolver: {self.running}/{self.workers} running, queued {queued}'
@@ -1,13 +1,20 @@
-import subprocess
+import asyncio
+import itertools
 import os
+import threading
 import yt_dlp
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import aclosing
+from functools import partial
+from urllib.parse import urlparse
+from .audio import playback_mode
 from .music import Song, Playlist, Time
-from typing import Literal
-
-
-# spotify
-import spotipy
-from spotipy.oauth2 import SpotifyClientCredentials
+from .cache import stream_cache
+from typing import AsyncIterator, Callable, Iterator, Literal, TypeVar
+from .probe import probe
+from .remote import remote_resolver
+from .scheduler import LANE_INTERACTIVE, ResolverScheduler
+from .spotify import SpotifyClient, spotify_id
 
 # .env
 from dotenv import load_dotenv, find_dotenv
@@ -18,10 +25,6 @@ load_dotenv(find_dotenv())
 CLIENT_ID = os.getenv('CLIENT_ID')
 CLIENT_SECRET = os.getenv('CLIENT_SECRET')
 
-FFMPEG_OPTIONS = {
-    'before_options': '-reconnect 1 -reconnect_streamed 1 -reconnect_delay_max 5',
-    'options': '-vn'
-}
 
 YTDL_OPTIONS = {
     'format': 'bestaudio/best',
@@ -36,36 +39,93 @@ YTDL_OPTIONS = {
 #    'cookiesfrombrowser': ('firefox', 'default', None, 'Meta'),
 }
 
-ytdl = yt_dlp.YoutubeDL(YTDL_OPTIONS)
+# songs extracted from a youtube playlist at a time
+YT_PLAYLIST_WINDOW = 100
+# number of threads doing yt-dlp/spotify/ffprobe lookups
+RESOLVER_WORKERS = 4
+
+T = TypeVar('T')
+
+_worker = threading.local()
+resolver_pool = ThreadPoolExecutor(
+    max_workers=RESOLVER_WORKERS,
+    thread_name_prefix='resolver'
+)
+resolver = ResolverScheduler(resolver_pool, RESOLVER_WORKERS)
+
+
+def get_ytdl() -> yt_dlp.YoutubeDL:
+    """Get the YoutubeDL instance owned by the current thread."""
+    ytdl = getattr(_worker, 'ytdl', None)
+    if ytdl is None:
+        ytdl = _worker.ytdl = yt_dlp.YoutubeDL(YTDL_OPTIONS)
+    return ytdl
+
+
+async def run_in_resolver(
+    func: Callable[..., T],
+    *args,
+    guild_id: int | None = None,
+    lane: int = LANE_INTERACTIVE,
+    discard: Callable[[T], None] | None = None
+) -> T:
+    """Run a blocking lookup in the resolver pool, shared fairly between servers.
+
+    Parameters
+    -----------
+    func: Callable[..., T]
+        The lookup, wrap it in a partial for keyword arguments.
+    guild_id: :class:`int`
+        The server the lookup is made for.
+    lane: :class:`int`
+        :data:`LANE_INTERACTIVE` for what a user waits on, :data:`LANE_BACKGROUND` otherwise.
+    discard: Callable[[T], None]
+        Gets the result if the caller was cancelled while the lookup ran.
+    """
+    return await resolver.run(partial(func, *args), guild_id, lane, discard)
 
 
 class Youtube():
-    def get_url_from_formats(self, formats) -> str | None:
+    @staticmethod
+    def get_url_from_formats(formats) -> str | None:
+        fallback = None
         for format in reversed(formats):
             if 'manifest_url' in format or 'ext' not in format:
                 continue
+            elif format['ext'] == 'webm' and format.get('acodec') == 'opus' and format.get('vcodec') == 'none':
+                # opus audio can go to discord without being re-encoded
+                if playback_mode() == 'opus':
+                    return format['url']
+                fallback = fallback or format['url']
             elif format['ext'] == 'm4a':
-                return format['url']
+                if playback_mode() == 'pcm':
+                    return format['url']
+                fallback = fallback or format['url']
+        return fallback
 
     def from_query(self, query: str) -> Song | Literal[False]:
+        """The first search result, from the search page alone.
+
+        Its stream url is resolved once it nears the head of the queue, urls
+        resolved now could expire before the song gets to play."""
         try:
-            data = ytdl.extract_info(query, download=False, process=True)
-            entry = data['entries'][0]
-            song = Song(
+            data = get_ytdl().extract_info(f'ytsearch1:{query}', download=False, process=False)
+            entry = next(iter(data['entries']))
+            return Song(
                 type='youtube',
                 title=entry['title'],
-                thumbnail=entry['thumbnail'],
-                duration=Time(entry['duration']),
-                yturl=entry['webpage_url'],
-                url=entry['url']
+                thumbnail=entry['thumbnails'][-1]['url'],
+                length=entry.get('duration') or 0,
+                yturl=entry['url']
             )
-            return song
         except Exception:
             return False
 
     def from_query_multiple(self, query: str, amount: int = 5) -> list[Song] | Literal[False]:
+        if remote := remote_resolver():
+            return remote.youtube('from_query_multiple', query, amount)
         try:
-            data = ytdl.extract_info(
+            data = get_ytdl().extract_info(
                 f'ytsearch{amount}:{query}',
                 download=False,
                 process=False
@@ -76,7 +136,7 @@ class Youtube():
                     type='youtube',
                     title=entry['title'],
                     thumbnail=entry['thumbnails'][-1]['url'],
-                    duration=Time(entry['duration']),
+                    length=entry['duration'],
                     yturl=entry['url']
                 )
                 songs.append(song)
@@ -85,16 +145,19 @@ class Youtube():
             return False
 
     def from_url(self, url: str) -> Song | Literal[False]:
+        if remote := remote_resolver():
+            return remote.youtube('from_url', url)
         try:
-            entry = ytdl.extract_info(url, download=False, process=False)
+            entry = get_ytdl().extract_info(url, download=False, process=False)
             song = Song(
                 type='youtube',
                 title=entry['title'],
                 thumbnail=entry['thumbnail'],
-                duration=Time(entry['duration']),
+                length=entry['duration'],
                 yturl=entry['webpage_url'],
                 url=self.get_url_from_formats(entry['formats'])
             )
+            stream_cache.put(entry['id'], song.url)
             return song
         except Exception:
             return False
@@ -103,18 +166,18 @@ class Youtube():
         try:
             playlist_id = url.split('list=')[-1].split('&')[0]
             url = 'https://www.youtube.com/playlist?list=' + playlist_id
-            data = ytdl.extract_info(url, download=False, process=False)
+            data = get_ytdl().extract_info(url, download=False, process=False)
             songs: list[Song] = []
             track_num = 0
-            duration = Time(0)
+            duration = 0.
             for entry in data['entries']:
                 track_num += 1
-                duration += Time(entry['duration'])
+                duration += entry['duration'] or 0
                 song = Song(
                     type='youtube',
                     title=entry['title'],
                     thumbnail=entry['thumbnails'][-1]['url'],
-                    duration=Time(entry['duration']),
+                    length=entry['duration'],
                     yturl=entry['url']
                 )
                 songs.append(song)
@@ -122,99 +185,217 @@ class Youtube():
                 title=data['title'],
                 url=data['webpage_url'],
                 thumbnail=data['thumbnails'][-1]['url'],
-                duration=duration,
-                track_num=track_num
+                duration=Time(duration),
+                track_num=track_num,
+                loaded=track_num
             )
             return songs, playlist
         except Exception:
             return False
 
 
-class Spotify():
-    sp = spotipy.Spotify(
-        auth_manager=SpotifyClientCredentials(
-            client_id=CLIENT_ID,
-            client_secret=CLIENT_SECRET
+def extract_stream(yturl: str) -> tuple[str | None, float | None]:
+    """The audio url of a youtube video and its duration."""
+    data = get_ytdl().extract_info(yturl, download=False, process=False)
+    return Youtube.get_url_from_formats(data['formats']), data.get('duration')
+
+
+class PlaylistCursor():
+    """Extracts a youtube playlist one window of songs at a time.
+
+    Attributes
+    -----------
+    url: :class:`str`
+        The playlist url.
+    window: :class:`int`
+        How many entries each extraction goes through.
+    playlist: :class:`Playlist`
+        The playlist, its length and duration grow as windows are extracted.
+    last: :class:`Song`
+        The last extracted song, the next window is queued after it.
+    message: :class:`discord.Message`
+        The playlist embed to keep up to date.
+    done: :class:`bool`
+        Whether the whole playlist was extracted.
+    """
+
+    def __init__(self, url: str, window: int = YT_PLAYLIST_WINDOW):
+        playlist_id = url.split('list=')[-1].split('&')[0]
+        self.url = 'https://www.youtube.com/playlist?list=' + playlist_id
+        self.window = window
+        # the entries generator keeps using the instance that created it
+        self.ytdl = yt_dlp.YoutubeDL(YTDL_OPTIONS)
+        self.entries: Iterator[dict] | None = None
+        self.playlist: Playlist | None = None
+        self.last: Song | None = None
+        self.message = None
+        self.done = False
+        self.lock = threading.Lock()
+
+    def open(self):
+        data = self.ytdl.extract_info(self.url, download=False, process=False)
+        self.entries = iter(data['entries'])
+        self.playlist = Playlist(
+            title=data['title'],
+            url=data['webpage_url'],
+            thumbnail=data['thumbnails'][-1]['url'],
+            duration=Time(0),
+            track_num=data.get('playlist_count') or 0,
+            loaded=0,
+            pending=self
         )
-    )
 
-    def from_track(self, query: str) -> Song:
-        result = self.sp.track(query)
-        title = result['name']
-        artist = result['artists'][0]['name'] if result['artists'] else None
+    def next_window(self) -> list[Song]:
+        with self.lock:
+            if self.entries is None:
+                self.open()
+            songs: list[Song] = []
+            count = 0
+            duration = 0.
+            for entry in itertools.islice(self.entries, self.window):
+                count += 1
+                # private and deleted videos have no duration
+                if not entry.get('duration'):
+                    continue
+                song = Song(
+                    type='youtube',
+                    title=entry['title'],
+                    thumbnail=entry['thumbnails'][-1]['url'],
+                    length=entry['duration'],
+                    yturl=entry['url']
+                )
+                songs.append(song)
+                duration += song.length
+            self.playlist.duration += Time(duration)
+            self.playlist.loaded += count
+            if count < self.window:
+                self.done = True
+                self.playlist.track_num = self.playlist.loaded
+                self.playlist.pending = None
+            else:
+                self.playlist.track_num = max(
+                    self.playlist.track_num,
+                    self.playlist.loaded
+                )
+            if songs:
+                self.last = songs[-1]
+            return songs
+
+
+class Spotify():
+    client = SpotifyClient(CLIENT_ID, CLIENT_SECRET)
+    PLAYLIST_PAGE = 100
+    ALBUM_PAGE = 50
+
+    def song_from_track(self, track: dict, thumbnail: str | None = None) -> Song:
+        title = track['name']
+        artist = track['artists'][0]['name'] if track['artists'] else None
+        if 'album' in track:
+            images = track['album']['images']
+            thumbnail = images[0]['url'] if images else None
         song = Song(
             type='spotify',
             title=f'{artist} - {title}' if artist else title,
-            thumbnail=result['album']['images'][0]['url'] if result['album']['images'] else None,
-            duration=Time(result['duration_ms']//1000),
-            spurl=result['external_urls']['spotify'] if result['external_urls'] else None,
+            thumbnail=thumbnail,
+            length=track['duration_ms']//1000,
+            spurl=track['external_urls']['spotify'] if track['external_urls'] else None,
         )
         return song
 
-    def from_playlist(self, query: str) -> tuple[list[Song], Playlist]:
-        result = self.sp.playlist(query)
-        # scroll through tracks pages
-        tracks = result['tracks']['items']
-        while result['tracks']['next']:
-            result['tracks'] = self.sp.next(result['tracks'])
-            tracks.extend(result['tracks']['items'])
+    def songs_from_items(self, items: list[dict], thumbnail: str | None = None) -> list[Song]:
         songs: list[Song] = []
-        track_num = 0
-        duration = Time(0)
-        for track in tracks:
-            track_num += 1
-            duration += Time(track['track']['duration_ms']//1000)
-            title = track['track']['name']
-            artist = track['track']['artists'][0]['name'] if track['track']['artists'] else None
-            song = Song(
-                type='spotify',
-                title=f'{artist} - {title}' if artist else title,
-                thumbnail=track['track']['album']['images'][0]['url'] if track['track']['album']['images'] else None,
-                duration=Time(track['track']['duration_ms']//1000),
-                spurl=track['track']['external_urls']['spotify'] if track['track']['external_urls'] else None,
-            )
-            songs.append(song)
+        for item in items:
+            # playlist items wrap the track, album items are the track
+            track = item['track'] if 'track' in item else item
+            if track:
+                songs.append(self.song_from_track(track, thumbnail))
+        return songs
+
+    async def from_track(self, query: str) -> Song:
+        return self.song_from_track(await self.client.track(spotify_id(query)))
+
+    async def from_tracks(self, queries: list[str]) -> list[Song | None]:
+        """Look several tracks up in as few requests as possible."""
+        tracks = await self.client.tracks([spotify_id(query) for query in queries])
+        return [self.song_from_track(track) if track else None for track in tracks]
+
+    async def playlist_first_page(self, query: str) -> tuple[list[Song], Playlist]:
+        result = await self.client.playlist(spotify_id(query, 'playlist'))
+        songs = self.songs_from_items(result['tracks']['items'])
         playlist = Playlist(
             title=result['name'],
             url=result['external_urls']['spotify'],
-            thumbnail=result['images'][0]['url'],
-            duration=duration,
-            track_num=track_num
+            thumbnail=result['images'][0]['url'] if result['images'] else None,
+            duration=Time(sum(song.length for song in songs)),
+            track_num=result['tracks']['total'],
+            loaded=len(result['tracks']['items'])
         )
         return songs, playlist
 
-    def from_album(self, query: str) -> tuple[list[Song], Playlist]:
-        result = self.sp.album(query)
-        # scroll through tracks pages
-        tracks = result['tracks']['items']
-        while result['tracks']['next']:
-            result['tracks'] = self.sp.next(result['tracks'])
-            tracks.extend(result['tracks']['items'])
-        songs: list[Song] = []
-        track_num = 0
-        duration = Time(0)
-        for track in tracks:
-            track_num += 1
-            duration += Time(track['duration_ms']//1000)
-            title = track['name']
-            artist = track['artists'][0]['name'] if track['artists'] else None
-            song = Song(
-                type='spotify',
-                title=f'{artist} - {title}' if artist else title,
-                thumbnail=result['images'][0]['url'] if result['images'] else None,
-                duration=Time(track['duration_ms']//1000),
-                spurl=track['external_urls']['spotify'] if track['external_urls'] else None,
-            )
-            songs.append(song)
+    async def playlist_page(self, query: str, offset: int) -> tuple[list[Song], int]:
+        result = await self.client.playlist_items(
+            spotify_id(query, 'playlist'),
+            offset=offset,
+            limit=self.PLAYLIST_PAGE
+        )
+        return self.songs_from_items(result['items']), len(result['items'])
+
+    async def album_first_page(self, query: str) -> tuple[list[Song], Playlist]:
+        result = await self.client.album(spotify_id(query, 'album'))
+        thumbnail = result['images'][0]['url'] if result['images'] else None
+        songs = self.songs_from_items(result['tracks']['items'], thumbnail)
         playlist = Playlist(
             title=result['name'],
             url=result['external_urls']['spotify'],
-            thumbnail=result['images'][0]['url'],
-            duration=duration,
-            track_num=track_num
+            thumbnail=thumbnail,
+            duration=Time(sum(song.length for song in songs)),
+            track_num=result['tracks']['total'],
+            loaded=len(result['tracks']['items'])
         )
         return songs, playlist
 
+    async def album_page(self, query: str, offset: int, thumbnail: str | None) -> tuple[list[Song], int]:
+        result = await self.client.album_tracks(
+            spotify_id(query, 'album'),
+            offset=offset,
+            limit=self.ALBUM_PAGE
+        )
+        return self.songs_from_items(result['items'], thumbnail), len(result['items'])
+
+    async def iter_pages(self, query: str, album: bool = False) -> AsyncIterator[tuple[list[Song], Playlist]]:
+        """Yield a playlist or album page by page.
+
+        The first page is yielded as soon as it arrives, the rest are fetched
+        concurrently and yielded in order. The playlist is updated in place."""
+        if album:
+            songs, playlist = await self.album_first_page(query)
+            page_size = self.ALBUM_PAGE
+            fetch = partial(self.album_page, query, thumbnail=playlist.thumbnail)
+        else:
+            songs, playlist = await self.playlist_first_page(query)
+            page_size = self.PLAYLIST_PAGE
+            fetch = partial(self.playlist_page, query)
+        yield songs, playlist
+        pages = [
+            asyncio.ensure_future(fetch(offset=offset))
+            for offset in range(playlist.loaded, playlist.track_num, page_size)
+        ]
+        try:
+            for page in pages:
+                songs, count = await page
+                playlist.loaded += count
+                playlist.duration += Time(sum(song.length for song in songs))
+                yield songs, playlist
+        finally:
+            for page in pages:
+                page.cancel()
+
+    async def from_playlist(self, query: str, album: bool = False) -> tuple[list[Song], Playlist]:
+        songs: list[Song] = []
+        async for page, playlist in self.iter_pages(query, album):
+            songs += page
+        return songs, playlist
+
 
 class File():
     FILE_EXTS = [
@@ -226,59 +407,138 @@ class File():
         '.mp3'
     ]
 
-    def sec_from_url(self, url: str) -> float | Literal[False]:
+    async def sec_from_url(self, url: str) -> float | Literal[False]:
         try:
-            cmd = f'ffprobe -i {url} -show_entries format=duration -v quiet -of csv="p=0"'
-            output = subprocess.check_output(cmd, shell=True)
-            return float(output)
+            return (await probe(url)).duration
         except Exception:
             return False
 
-    def search_url(self, link: str) -> Song:
-        filename, fileext = os.path.splitext(link)
+    async def search_url(self, link: str) -> Song:
+        filename, fileext = os.path.splitext(urlparse(link).path)
         if fileext not in self.FILE_EXTS:
             raise Exception(
                 'Invalid File type provided!\nSupported formats are: `wav, matroska/webm, mp4, flac, ogg, mp3`'
             )
         filename = filename.split('/')[-1]
-        sec = self.sec_from_url(link)
+        sec = await self.sec_from_url(link)
         if not sec:
             raise Exception('Unable to play this file.')
         song = Song(
             type='file',
             title=f'{fileext[1:]} - {filename}',
             thumbnail=None,
-            duration=Time(int(sec)),
+            length=int(sec),
             url=link,
         )
         return song
 
 
 def search(query: str) -> tuple[list[Song], Playlist | Literal[False]]:
-    """Auto song search."""
+    """Auto song search for youtube links and queries, see :func:`resolve` for the rest."""
     youtube = Youtube()
-    spotify = Spotify()
-    file = File()
     songs: list[Song] = []
     playlist: Playlist | Literal[False] = False
-    # spotify
-    if query.startswith('https://open.spotify.com/track/') or query.startswith('spotify:track:'):
-        songs.append(spotify.from_track(query))
-    elif query.startswith('https://open.spotify.com/playlist/') or query.startswith('spotify:playlist:'):
-        songs, playlist = spotify.from_playlist(query)
-    elif query.startswith('https://open.spotify.com/album/') or query.startswith('spotify:album:'):
-        songs, playlist = spotify.from_album(query)
     # youtube
-    elif query.startswith('https://www.youtube.com/') or query.startswith('https://youtu.be/'):
+    if query.startswith('https://www.youtube.com/') or query.startswith('https://youtu.be/'):
         if 'playlist?list=' in query or '&list=' in query:
             songs, playlist = youtube.from_playlist(query)
         else:
             songs.append(youtube.from_url(query))
-    # link
-    elif query.startswith('https://'):
-        songs.append(file.search_url(query))
     # query
     else:
         songs.append(youtube.from_query(query))
     songs = [song for song in songs if song]  # remove any failed song
     return songs, playlist
+
+
+def is_youtube(query: str) -> bool:
+    return query.startswith('https://www.youtube.com/') or query.startswith('https://youtu.be/')
+
+
+def is_spotify(query: str, kind: str) -> bool:
+    return query.startswith(f'https://open.spotify.com/{kind}/') or query.startswith(f'spotify:{kind}:')
+
+
+async def resolve(query: str, guild_id: int | None = None) -> tuple[list[Song], Playlist | Literal[False]]:
+    """Auto song search without blocking the event loop."""
+    if remote := remote_resolver():
+        songs: list[Song] = []
+        playlist: Playlist | Literal[False] = False
+        async with aclosing(remote.pages(query, guild_id)) as pages:
+            async for page, playlist in pages:
+                songs += page
+        # youtube playlists come a window at a time, the rest is extracted here
+        while playlist and (cursor := playlist.pending):
+            songs += await run_in_resolver(cursor.next_window, guild_id=guild_id)
+        return songs, playlist
+    spotify = Spotify()
+    if is_spotify(query, 'track'):
+        return [await spotify.from_track(query)], False
+    elif is_spotify(query, 'playlist'):
+        return await spotify.from_playlist(query)
+    elif is_spotify(query, 'album'):
+        return await spotify.from_playlist(query, album=True)
+    elif query.startswith('https://') and not is_youtube(query):
+        return [await File().search_url(query)], False
+    return await run_in_resolver(search, query, guild_id=guild_id)
+
+
+async def resolve_many(links: list[str], guild_id: int | None = None) -> tuple[list[Song], int]:
+    """Resolve several links at once, spotify tracks share batched lookups.
+
+    Returns the songs and how many of the links couldn't be resolved."""
+    spotify = Spotify()
+    tracks = [link for link in links if is_spotify(link, 'track')]
+    others = [link for link in links if not is_spotify(link, 'track')]
+    results = await asyncio.gather(
+        spotify.from_tracks(tracks),
+        *(resolve(link, guild_id) for link in others),
+        return_exceptions=True
+    )
+    resolved: dict[str, list[Song]] = {}
+    if isinstance(results[0], Exception):
+        print(results[0])
+    else:
+        for link, song in zip(tracks, results[0]):
+            resolved[link] = [song] if song else []
+    for link, result in zip(others, results[1:]):
+        if isinstance(result, Exception):
+            print(result)
+        else:
+            resolved[link] = result[0]
+    failed = sum(1 for link in links if not resolved.get(link))
+    return [song for link in links for song in resolved.get(link, [])], failed
+
+
+async def resolve_pages(query: str, guild_id: int | None = None) -> AsyncIterator[tuple[list[Song], Playlist | Literal[False]]]:
+    """Auto song search that yields long playlists page by page."""
+    if remote := remote_resolver():
+        async for page in remote.pages(query, guild_id):
+            yield page
+        return
+    spotify = Spotify()
+    links = query.split()
+    if len(links) > 1 and all(link.startswith('https://') or link.startswith('spotify:') for link in links):
+        songs, failed = await resolve_many(links, guild_id)
+        yield songs, False
+        # after the ones that did resolve are queued
+        if failed:
+            raise Exception(f'Could not find {failed} of the {len(links)} links.')
+    elif is_spotify(query, 'playlist'):
+        async for songs, playlist in spotify.iter_pages(query):
+            yield songs, playlist
+    elif is_spotify(query, 'album'):
+        async for songs, playlist in spotify.iter_pages(query, album=True):
+            yield songs, playlist
+    elif (query.startswith('https://www.youtube.com/') or query.startswith('https://youtu.be/')) and ('playlist?list=' in query or '&list=' in query):
+        # only the first window, the rest is extracted as the queue drains
+        cursor = PlaylistCursor(query)
+        try:
+            songs = await run_in_resolver(cursor.next_window, guild_id=guild_id)
+        except Exception as e:
+            print(e)
+            yield [], False
+            return
+        yield songs, cursor.playlist
+    else:
+        yield await resolve(query, guild_id)
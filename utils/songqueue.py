@@ -0,0 +1,276 @@
+import random
+from typing import Iterable, Iterator
+
+
+def duration_of(song) -> float:
+    return song.length or 0.
+
+
+class _Node:
+    __slots__ = ('song', 'prio', 'left', 'right', 'size', 'total', 'flip')
+
+    def __init__(self, song):
+        self.song = song
+        self.prio = random.random()
+        self.left: _Node | None = None
+        self.right: _Node | None = None
+        self.size = 1
+        self.total = duration_of(song)
+        self.flip = False
+
+
+def _size(node: _Node | None) -> int:
+    return node.size if node else 0
+
+
+def _total(node: _Node | None) -> float:
+    return node.total if node else 0.
+
+
+def _update(node: _Node):
+    node.size = 1 + _size(node.left) + _size(node.right)
+    node.total = duration_of(node.song) + _total(node.left) + _total(node.right)
+
+
+def _push(node: _Node):
+    """Apply a pending reversal to the node's children."""
+    if node.flip:
+        node.left, node.right = node.right, node.left
+        if node.left:
+            node.left.flip = not node.left.flip
+        if node.right:
+            node.right.flip = not node.right.flip
+        node.flip = False
+
+
+def _split(node: _Node | None, k: int) -> tuple[_Node | None, _Node | None]:
+    """Split into the first k songs and the rest."""
+    if node is None:
+        return None, None
+    _push(node)
+    if _size(node.left) >= k:
+        left, node.left = _split(node.left, k)
+        _update(node)
+        return left, node
+    node.right, right = _split(node.right, k - _size(node.left) - 1)
+    _update(node)
+    return node, right
+
+
+def _merge(left: _Node | None, right: _Node | None) -> _Node | None:
+    if left is None:
+        return right
+    if right is None:
+        return left
+    if left.prio > right.prio:
+        _push(left)
+        left.right = _merge(left.right, right)
+        _update(left)
+        return left
+    _push(right)
+    right.left = _merge(left, right.left)
+    _update(right)
+    return right
+
+
+def _build(songs: Iterable) -> _Node | None:
+    """Build a treap from songs in order, in linear time."""
+    stack: list[_Node] = []
+    for song in songs:
+        node = _Node(song)
+        last = None
+        while stack and stack[-1].prio < node.prio:
+            last = stack.pop()
+            _update(last)
+        node.left = last
+        if stack:
+            stack[-1].right = node
+        stack.append(node)
+    root = None
+    while stack:
+        root = stack.pop()
+        _update(root)
+    return root
+
+
+class SongQueue:
+    """List-like song queue backed by an implicit treap.
+
+    Every node keeps the size and total duration of its subtree, so head pops,
+    inserts, moves, range removals and the wait time up to a position all take
+    O(log n). Reversing is O(1) and applied lazily.
+    """
+
+    def __init__(self, songs: Iterable = ()):
+        self.root: _Node | None = _build(songs)
+
+    def __len__(self):
+        return _size(self.root)
+
+    def __bool__(self):
+        return self.root is not None
+
+    def __iter__(self) -> Iterator:
+        stack: list[_Node] = []
+        node = self.root
+        while stack or node:
+            while node:
+                _push(node)
+                stack.append(node)
+                node = node.left
+            node = stack.pop()
+            yield node.song
+            node = node.right
+
+    def __repr__(self):
+        return f'SongQueue({list(self)!r})'
+
+    def index_range(self, pos: int) -> int:
+        length = len(self)
+        if pos < 0:
+            pos += length
+        if not 0 <= pos < length:
+            raise IndexError('queue index out of range')
+        return pos
+
+    def node_at(self, pos: int) -> _Node:
+        node = self.root
+        while True:
+            _push(node)
+            left = _size(node.left)
+            if pos < left:
+                node = node.left
+            elif pos == left:
+                return node
+            else:
+                pos -= left + 1
+                node = node.right
+
+    def __getitem__(self, pos: int | slice):
+        if isinstance(pos, slice):
+            start, stop, step = pos.indices(len(self))
+            if step != 1:
+                return list(self)[pos]
+            songs = []
+            if start >= stop:
+                return songs
+            left, rest = _split(self.root, start)
+            middle, right = _split(rest, stop - start)
+            songs = list(SongQueue.from_root(middle))
+            self.root = _merge(left, _merge(middle, right))
+            return songs
+        return self.node_at(self.index_range(pos)).song
+
+    def __setitem__(self, pos: int | slice, value):
+        if isinstance(pos, slice):
+            start, stop, step = pos.indices(len(self))
+            if step != 1:
+                raise ValueError('queue slices can\'t have a step')
+            left, rest = _split(self.root, start)
+            _, right = _split(rest, max(0, stop - start))
+            self.root = _merge(_merge(left, _build(value)), right)
+            return
+        left, rest = _split(self.root, self.index_range(pos))
+        middle, right = _split(rest, 1)
+        middle.song = value
+        _update(middle)
+        self.root = _merge(left, _merge(middle, right))
+
+    def __delitem__(self, pos: int | slice):
+        if isinstance(pos, slice):
+            start, stop, step = pos.indices(len(self))
+            if step != 1:
+                songs = list(self)
+                del songs[pos]
+                self.root = _build(songs)
+                return
+            if start >= stop:
+                return
+            left, rest = _split(self.root, start)
+            _, right = _split(rest, stop - start)
+            self.root = _merge(left, right)
+            return
+        self.pop(pos)
+
+    def __iadd__(self, songs: Iterable):
+        self.extend(songs)
+        return self
+
+    @classmethod
+    def from_root(cls, root: _Node | None) -> 'SongQueue':
+        queue = cls()
+        queue.root = root
+        return queue
+
+    def append(self, song):
+        self.root = _merge(self.root, _build((song,)))
+
+    def extend(self, songs: Iterable):
+        self.root = _merge(self.root, _build(songs))
+
+    def insert(self, pos: int, song):
+        length = len(self)
+        if pos < 0:
+            pos = max(0, pos + length)
+        pos = min(pos, length)
+        left, right = _split(self.root, pos)
+        self.root = _merge(_merge(left, _build((song,))), right)
+
+    def pop(self, pos: int = -1):
+        pos = self.index_range(pos)
+        left, rest = _split(self.root, pos)
+        middle, right = _split(rest, 1)
+        self.root = _merge(left, right)
+        return middle.song
+
+    def find(self, song) -> int:
+        """Position of this exact song in the queue, -1 if it isn't queued."""
+        for pos, queued in enumerate(self):
+            if queued is song:
+                return pos
+        return -1
+
+    def clear(self):
+        self.root = None
+
+    def reverse(self):
+        if self.root:
+            self.root.flip = not self.root.flip
+
+    def shuffle(self):
+        songs = list(self)
+        random.shuffle(songs)
+        self.root = _build(songs)
+
+    def move(self, _from: int, _to: int):
+        self.insert(_to, self.pop(_from))
+
+    def swap(self, pos1: int, pos2: int):
+        pos1, pos2 = sorted((self.index_range(pos1), self.index_range(pos2)))
+        if pos1 == pos2:
+            return
+        left, rest = _split(self.root, pos1)
+        first, rest = _split(rest, 1)
+        middle, rest = _split(rest, pos2 - pos1 - 1)
+        second, right = _split(rest, 1)
+        self.root = _merge(_merge(_merge(_merge(left, second), middle), first), right)
+
+    def wait_time(self, pos: int) -> float:
+        """Total duration of the songs before a position, in seconds."""
+        pos = max(0, min(pos, len(self)))
+        waited = 0.
+        node = self.root
+        while node and pos > 0:
+            _push(node)
+            left = _size(node.left)
+            if pos <= left:
+                node = node.left
+            else:
+                waited += _total(node.left) + duration_of(node.song)
+                pos -= left + 1
+                node = node.right
+        return waited
+
+    @property
+    def duration(self) -> float:
+        return _total(self.root)
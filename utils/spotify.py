@@ -0,0 +1,122 @@
+import asyncio
+import re
+import time
+import aiohttp
+
+API_URL = 'https://api.spotify.com/v1'
+TOKEN_URL = 'https://accounts.spotify.com/api/token'
+# most ids the tracks endpoint takes per request
+TRACKS_BATCH = 50
+# seconds before expiry that the token gets renewed
+TOKEN_MARGIN = 60
+# only what Song and Playlist are built from
+TRACK_FIELDS = 'name,duration_ms,external_urls,artists(name),album(images)'
+PLAYLIST_FIELDS = f'name,external_urls,images,tracks(total,items(track({TRACK_FIELDS})))'
+PLAYLIST_ITEMS_FIELDS = f'items(track({TRACK_FIELDS}))'
+
+
+def spotify_id(url: str | None, kind: str = 'track') -> str | None:
+    """Get the spotify id from a track, playlist or album url or uri."""
+    if not url:
+        return None
+    match = re.search(rf'(?:{kind}/|{kind}:)([0-9A-Za-z]{{22}})', url)
+    return match.group(1) if match else None
+
+
+class SpotifyClient:
+    """Asynchronous Spotify Web API client using client credentials.
+
+    Attributes
+    -----------
+    client_id: :class:`str`
+        The spotify application's client id.
+    client_secret: :class:`str`
+        The spotify application's client secret.
+    token: :class:`str`
+        The current access token, reused until it expires.
+    expires_at: :class:`float`
+        When the access token expires.
+    """
+
+    def __init__(self, client_id: str | None, client_secret: str | None):
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.token: str | None = None
+        self.expires_at = 0.
+        self.session: aiohttp.ClientSession | None = None
+        self.token_lock: asyncio.Lock | None = None
+
+    def get_session(self) -> aiohttp.ClientSession:
+        if self.session is None or self.session.closed:
+            self.session = aiohttp.ClientSession()
+            self.token_lock = asyncio.Lock()
+        return self.session
+
+    async def close(self):
+        if self.session and not self.session.closed:
+            await self.session.close()
+        self.session = None
+
+    async def get_token(self, renew: bool = False) -> str:
+        session = self.get_session()
+        async with self.token_lock:
+            if not renew and self.token and time.time() < self.expires_at - TOKEN_MARGIN:
+                return self.token
+            async with session.post(
+                TOKEN_URL,
+                data={'grant_type': 'client_credentials'},
+                auth=aiohttp.BasicAuth(self.client_id, self.client_secret)
+            ) as response:
+                response.raise_for_status()
+                data = await response.json()
+            self.token = data['access_token']
+            self.expires_at = time.time() + data['expires_in']
+            return self.token
+
+    async def get(self, path: str, **params) -> dict:
+        session = self.get_session()
+        renewed = False
+        while True:
+            token = await self.get_token()
+            async with session.get(
+                f'{API_URL}/{path}',
+                params=params,
+                headers={'Authorization': f'Bearer {token}'}
+            ) as response:
+                if response.status == 401 and not renewed:
+                    await self.get_token(renew=True)
+                    renewed = True
+                    continue
+                if response.status == 429:
+                    await asyncio.sleep(int(response.headers.get('Retry-After', 1)))
+                    continue
+                response.raise_for_status()
+                return await response.json()
+
+    async def track(self, track_id: str) -> dict:
+        return await self.get(f'tracks/{track_id}')
+
+    async def tracks(self, track_ids: list[str]) -> list[dict | None]:
+        """Look tracks up in batches, one request per fifty ids."""
+        batches = await asyncio.gather(*(
+            self.get('tracks', ids=','.join(track_ids[i:i+TRACKS_BATCH]))
+            for i in range(0, len(track_ids), TRACKS_BATCH)
+        ))
+        return [track for batch in batches for track in batch['tracks']]
+
+    async def playlist(self, playlist_id: str) -> dict:
+        return await self.get(f'playlists/{playlist_id}', fields=PLAYLIST_FIELDS)
+
+    async def playlist_items(self, playlist_id: str, offset: int, limit: int = 100) -> dict:
+        return await self.get(
+            f'playlists/{playlist_id}/tracks',
+            offset=offset,
+            limit=limit,
+            fields=PLAYLIST_ITEMS_FIELDS
+        )
+
+    async def album(self, album_id: str) -> dict:
+        return await self.get(f'albums/{album_id}')
+
+    async def album_tracks(self, album_id: str, offset: int, limit: int = 50) -> dict:
+        return await self.get(f'albums/{album_id}/tracks', offset=offset, limit=limit)